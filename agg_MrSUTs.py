@@ -7,12 +7,22 @@ Description: Aggregates to EU and ROW previously pickled mrSUT Exiobase V3.3
 @author:Franco Donati
 @institution:Leiden University CML
 """
+import os
 import pickle as pk
 import pandas as pd
 import numpy as np
-
-
-# General mrSUTs Characteristics
+from scipy import sparse
+from concurrent.futures import ThreadPoolExecutor
+import store_mrSUTs as st
+import parse_mrSUTs as pm
+import sparse_mrSUTs as sp
+import labels_mrSUTs as lb
+import instrument_mrSUTs as ins
+import balance_mrSUTs as bl
+
+
+# General mrSUTs Characteristics, for reference only: the aggregation infers
+# them from the labels
 countries_no = 49  # total number of countries and SUTs
 EU_no = 31  # total number of EU countries
 ROW_no = 18
@@ -21,17 +31,44 @@ ind_no = 163  # number of industries in the SUTs
 prod_no = 200  # number of products in the SUTs
 Y_no = 7  # number of final demand categories in the SUTs
 Be_no = 170  # number of environmental extensions
+sep_regions = ["EU", "ROW"]  # regions separated by sep_b_reg
+
+
+def reg_block(matrix, row_region=None, col_region=None):
+    """
+    Selects the rows and columns of a matrix of a region, None keeps the
+    whole axis. Positions are found on the integer codes of the labels
+    """
+    rows = slice(None)
+    if row_region is not None:
+        rows = lb.label_positions(matrix.index, "region", row_region)
+
+    cols = slice(None)
+    if col_region is not None:
+        cols = lb.label_positions(matrix.columns, "region", col_region)
 
-# Load serialised data
+    return(matrix.iloc[rows, cols])
 
-data = pd.read_pickle("mrSUT_V3.3.pkl")  # load pickled data
+
+def separable(data):
+    """
+    True if the regions of data are EU and ROW, the only ones sep_b_reg
+    and aggregate handle. Other regions go through aggregate_regions
+    """
+    regions = set(data["V"].index.get_level_values("region"))
+
+    return(regions == set(sep_regions))
 
 
 #  Separated by region
+@ins.timed("separate")
 def sep_b_reg(data):
     """
     separates SUTs by regions
     """
+    if not separable(data):
+        raise ValueError("sep_b_reg separates EU and ROW only, use "
+                         "aggregate_regions for other regions")
 
     # load data
     V_ = data["V"]  # Supply
@@ -56,50 +93,50 @@ def sep_b_reg(data):
     # separation section
 
     # Supply
-    V1 = V_.loc[["EU"], ["EU"]]  # EU
-    V2 = V_.loc[["EU"], ["ROW"]]  # export EU to ROW (import ROW from EU)
-    V3 = V_.loc[["ROW"], ["EU"]]  # export ROW to EU (import EU from ROW)
-    V4 = V_.loc[["ROW"], ["ROW"]]  # ROW
+    V1 = reg_block(V_, "EU", "EU")  # EU
+    V2 = reg_block(V_, "EU", "ROW")  # export EU to ROW (import ROW from EU)
+    V3 = reg_block(V_, "ROW", "EU")  # export ROW to EU (import EU from ROW)
+    V4 = reg_block(V_, "ROW", "ROW")  # ROW
 
     # Use
-    U1 = U_.loc[["EU"], ["EU"]]  # EU
-    U2 = U_.loc[["EU"], ["ROW"]]  # export EU to ROW (import ROW from EU)
-    U3 = U_.loc[["ROW"], ["EU"]]  # export ROW to EU (import EU from ROW)
-    U4 = U_.loc[["ROW"], ["ROW"]]  # ROW
+    U1 = reg_block(U_, "EU", "EU")  # EU
+    U2 = reg_block(U_, "EU", "ROW")  # export EU to ROW (import ROW from EU)
+    U3 = reg_block(U_, "ROW", "EU")  # export ROW to EU (import EU from ROW)
+    U4 = reg_block(U_, "ROW", "ROW")  # ROW
 
     # Final Demand
-    Y1 = Y_.loc[["EU"], ["EU"]]  # EU
-    Y2 = Y_.loc[["EU"], ["ROW"]]  # export EU to ROW (import ROW from EU)
-    Y3 = Y_.loc[["ROW"], ["EU"]]  # export ROW to EU (import EU from ROW)
-    Y4 = Y_.loc[["ROW"], ["ROW"]]  # ROW
+    Y1 = reg_block(Y_, "EU", "EU")  # EU
+    Y2 = reg_block(Y_, "EU", "ROW")  # export EU to ROW (import ROW from EU)
+    Y3 = reg_block(Y_, "ROW", "EU")  # export ROW to EU (import EU from ROW)
+    Y4 = reg_block(Y_, "ROW", "ROW")  # ROW
 
     # Factor inputs
-    E1 = E_.loc[:, ["EU"]]  # EU
-    E2 = E_.loc[:, ["ROW"]]  # ROW
+    E1 = reg_block(E_, None, "EU")  # EU
+    E2 = reg_block(E_, None, "ROW")  # ROW
 
     # Materials
-    Bm1 = Bm_.loc[:, ["EU"]]  # EU
-    Bm2 = Bm_.loc[:, ["ROW"]]  # ROW
+    Bm1 = reg_block(Bm_, None, "EU")  # EU
+    Bm2 = reg_block(Bm_, None, "ROW")  # ROW
 
     # Resources
-    Br1 = Br_.loc[:, ["EU"]]  # EU
-    Br2 = Br_.loc[:, ["ROW"]]  # ROW
+    Br1 = reg_block(Br_, None, "EU")  # EU
+    Br2 = reg_block(Br_, None, "ROW")  # ROW
 
     # Final Demand Emissions
-    Be1 = Be_.loc[:, ["EU"]]  # EU
-    Be2 = Be_.loc[:, ["ROW"]]  # ROW
+    Be1 = reg_block(Be_, None, "EU")  # EU
+    Be2 = reg_block(Be_, None, "ROW")  # ROW
 
     # Final Demand Materials
-    YBm1 = YBm_.loc[:, ["EU"]]  # EU
-    YBm2 = YBm_.loc[:, ["ROW"]]  # ROW
+    YBm1 = reg_block(YBm_, None, "EU")  # EU
+    YBm2 = reg_block(YBm_, None, "ROW")  # ROW
 
     # Finald Demand Resources
-    YBr1 = YBr_.loc[:, ["EU"]]  # EU
-    YBr2 = YBr_.loc[:, ["ROW"]]  # ROW
+    YBr1 = reg_block(YBr_, None, "EU")  # EU
+    YBr2 = reg_block(YBr_, None, "ROW")  # ROW
 
     # Final Demand Emissions
-    YBe1 = YBe_.loc[:, ["EU"]]  # EU
-    YBe2 = YBe_.loc[:, ["ROW"]]  # ROW
+    YBe1 = reg_block(YBe_, None, "EU")  # EU
+    YBe2 = reg_block(YBe_, None, "ROW")  # ROW
 
     # preparing to output
 
@@ -138,76 +175,126 @@ def sep_b_reg(data):
 
 
 # Separating by country and collecting
-def split_n_agg(item, no_Cgroup1, no_Cgroup2="", axis=0):
-    """
-    takes dataframes in a list and splits them by country
-    """
-    def aggregate(the_list, no_Cgr):
-        """ sums split dfs"""
-        base = the_list[0]
-        n = 1
-        while n < no_Cgr:
-            base = np.add(base, the_list[n])
-            n += 1
-        return (base)
-
-    split1 = np.split(item, no_Cgroup1, axis)
-    first = aggregate(split1, no_Cgroup1)
-
-    try:
-        split2 = np.split(first, no_Cgroup2, axis=1)
-        second = aggregate(split2, no_Cgroup2)
-    except (ValueError, TypeError):
-        return(first)
-    else:
-        return(second)
 
+# label levels that are summed over by the aggregation
+country_levels = ["country_code", "country_name", "CountryGroup",
+                  "CountryGroupName"]
 
-# Aggregation
-def aggregate(data):
+
+def concordance(index, levels=country_levels):
     """
-    aggregates SUTs by regions EU, ROW
+    Outputs a sparse concordance matrix that maps each label of index on
+    the same label without the country levels, and the aggregated labels
+    in order of first appearance
     """
+    keys = index.droplevel(levels)
+    codes, groups = pd.factorize(keys, use_na_sentinel=False)
+    groups.names = keys.names
 
-    # load data
-    V1 = data["V1"]  # Supply
-    V2 = data["V2"]
-    V3 = data["V3"]
-    V4 = data["V4"]
+    n = len(index)
+    C = sparse.csr_matrix((np.ones(n), (codes, np.arange(n))),
+                          shape=(len(groups), n))
+
+    return(C, groups)
+
+
+@ins.timed("agg_matrix")
+def agg_matrix(item, rows=True, columns=True):
+    """
+    Aggregates a dataframe over its countries with one sparse product per
+    axis (C·X·Cᵀ), the number of countries and categories are inferred
+    from the labels. Sums are accumulated in float64 and stored in the
+    float type of the dataframe (e.g. float32)
+    """
+    if sp.is_sparse(item):
+        values = sp.to_scipy(item)
+    else:
+        values = item.values
+    dtype = values.dtype
+    values = values.astype(np.float64, copy=False)
 
-    U1 = data["U1"]  # Use
-    U2 = data["U2"]
-    U3 = data["U3"]
-    U4 = data["U4"]
+    index = item.index
+    cols = item.columns
 
-    Y1 = data["Y1"]  # Final Demand
-    Y2 = data["Y2"]
-    Y3 = data["Y3"]
-    Y4 = data["Y4"]
+    if rows is True:
+        C, index = concordance(item.index)
+        values = C @ values
 
-    E1 = data["E1"]  # Factor inputs
-    E2 = data["E2"]
+    if columns is True:
+        C, cols = concordance(item.columns)
+        values = (C @ values.T).T
 
-    Bm1 = data["Bm1"]  # Materials
-    Bm2 = data["Bm2"]
+    if np.issubdtype(dtype, np.floating):
+        values = values.astype(dtype, copy=False)
 
-    Br1 = data["Br1"]  # Resources
-    Br2 = data["Br2"]
+    if sparse.issparse(values):
+        output = sp.to_frame(values.tocsr(), index, cols)
+    else:
+        output = pd.DataFrame(values, index=index, columns=cols)
 
-    Be1 = data["Be1"]  # Emissions
-    Be2 = data["Be2"]
+    return(output)
 
-    YBm1 = data["YBm1"]  # Final Demand Materials
-    YBm2 = data["YBm2"]
 
-    YBr1 = data["YBr1"]  # Final Demand Resources
-    YBr2 = data["YBr2"]
+# Aggregation
 
-    YBm1 = data["YBm1"]  # Final Demand Materials
-    YBm2 = data["YBm2"]
+# blocks of sep_b_reg aggregated by aggregate, True if their rows are
+# aggregated too (the rows of the extensions are kept)
+blocks = {"V1": True, "V2": True, "V3": True, "V4": True,  # Supply
+          "U1": True, "U2": True, "U3": True, "U4": True,  # Use
+          "Y1": True, "Y2": True, "Y3": True, "Y4": True,  # Final Demand
+          "E1": False, "E2": False,  # Factor inputs
+          "Bm1": False, "Bm2": False,  # Materials
+          "Br1": False, "Br2": False,  # Resources
+          "Be1": False, "Be2": False,  # Emissions
+          "YBm1": False, "YBm2": False,  # Final Demand Materials
+          "YBr1": False, "YBr2": False,  # Final Demand Resources
+          "YBe1": False, "YBe2": False,  # Final Demand Emissions
+          }
+threads = os.cpu_count() or 1  # default workers of aggregate, 1 is serial
+
+
+def block_cost(item):
+    """
+    Number of values of a block, the order of agg_blocks
+    """
+    return(item.shape[0] * item.shape[1])
 
-    YBe1 = data["YBe1"]  # Final Demand Emissions
-    YBe2 = data["YBe2"]
+
+def agg_blocks(data, workers=None):
+    """
+    Aggregates the blocks of data with agg_matrix in a pool of workers
+    threads (by default threads, at most one per block), largest blocks
+    first so that the last ones to finish are small. The sparse products
+    release the GIL, so the blocks run in parallel. workers=1 aggregates
+    them one after the other in this thread
+    """
+    names = sorted(blocks, key=lambda name: block_cost(data[name]),
+                   reverse=True)
+    if workers is None:
+        workers = threads
+    workers = max(1, min(workers, len(names)))
+
+    if workers == 1:
+        return({name: agg_matrix(data[name], rows=blocks[name])
+                for name in names})
+
+    with ThreadPoolExecutor(max_workers=workers, initializer=ins.inherit,
+                            initargs=(ins.open_stages(),)) as pool:
+        futures = {name: pool.submit(agg_matrix, data[name],
+                                     rows=blocks[name])
+                   for name in names}
+        output = {name: futures[name].result() for name in names}
+
+    return(output)
+
+
+@ins.timed("aggregate")
+def aggregate(data, workers=None):
+    """
+    aggregates SUTs by regions EU, ROW, the blocks are aggregated by
+    workers threads (see agg_blocks)
+    """
+    a = agg_blocks(data, workers)
 
     CrBe = data["CrBe"]  # Characterisation emissions
     CrBm = data["CrBm"]  # Characterisation materials
@@ -216,50 +303,50 @@ def aggregate(data):
     # Aggregation section
 
     # Supply
-    V1a = split_n_agg(V1, EU_no, EU_no)  # EU
-    V2a = split_n_agg(V2, EU_no, ROW_no)  # exp EU to ROW (import ROW from EU)
-    V3a = split_n_agg(V3, ROW_no, EU_no)  # exp ROW to EU (import EU from ROW)
-    V4a = split_n_agg(V4, ROW_no, ROW_no)  # ROW
+    V1a = a["V1"]  # EU
+    V2a = a["V2"]  # exp EU to ROW (import ROW from EU)
+    V3a = a["V3"]  # exp ROW to EU (import EU from ROW)
+    V4a = a["V4"]  # ROW
 
     # Use
-    U1a = split_n_agg(U1, EU_no, EU_no)  # EU
-    U2a = split_n_agg(U2, EU_no, ROW_no)  # exp EU to ROW (import ROW from EU)
-    U3a = split_n_agg(U3, ROW_no, EU_no)  # exp ROW to EU (import EU from ROW)
-    U4a = split_n_agg(U4, ROW_no, ROW_no)  # ROW
+    U1a = a["U1"]  # EU
+    U2a = a["U2"]  # exp EU to ROW (import ROW from EU)
+    U3a = a["U3"]  # exp ROW to EU (import EU from ROW)
+    U4a = a["U4"]  # ROW
 
     # Final Demand
-    Y1a = split_n_agg(Y1, EU_no, EU_no)  # EU
-    Y2a = split_n_agg(Y2, EU_no, ROW_no)  # EU from ROW
-    Y3a = split_n_agg(Y3, ROW_no, EU_no)  # EU
-    Y4a = split_n_agg(Y4, ROW_no, ROW_no)  # EU from ROW
+    Y1a = a["Y1"]  # EU
+    Y2a = a["Y2"]  # EU from ROW
+    Y3a = a["Y3"]  # EU
+    Y4a = a["Y4"]  # EU from ROW
 
     # Factor inputs
-    E1a = split_n_agg(E1, EU_no, axis=1)  # EU
-    E2a = split_n_agg(E2, ROW_no, axis=1)   # ROW
+    E1a = a["E1"]  # EU
+    E2a = a["E2"]   # ROW
 
     # Materials
-    Bm1a = split_n_agg(Bm1, EU_no, axis=1)  # EU
-    Bm2a = split_n_agg(Bm2, ROW_no, axis=1)  # ROW
+    Bm1a = a["Bm1"]  # EU
+    Bm2a = a["Bm2"]  # ROW
 
     # Resources
-    Br1a = split_n_agg(Br1, EU_no, axis=1)  # EU
-    Br2a = split_n_agg(Br2, ROW_no, axis=1)   # ROW
+    Br1a = a["Br1"]  # EU
+    Br2a = a["Br2"]   # ROW
 
     # Emissions
-    Be1a = split_n_agg(Be1, EU_no, axis=1)  # EU
-    Be2a = split_n_agg(Be2, ROW_no, axis=1)  # ROW
+    Be1a = a["Be1"]  # EU
+    Be2a = a["Be2"]  # ROW
 
     # Final Demand Materials
-    YBm1a = split_n_agg(YBm1, EU_no, countries_no, axis=1)  # EU
-    YBm2a = split_n_agg(YBm2, ROW_no, countries_no, axis=1)  # ROW
+    YBm1a = a["YBm1"]  # EU
+    YBm2a = a["YBm2"]  # ROW
 
     # Finald Demand Resources
-    YBr1a = split_n_agg(YBr1, EU_no, countries_no, axis=1)  # EU
-    YBr2a = split_n_agg(YBr2, ROW_no, countries_no, axis=1)  # ROW
+    YBr1a = a["YBr1"]  # EU
+    YBr2a = a["YBr2"]  # ROW
 
     # Final Demand Emissions
-    YBe1a = split_n_agg(YBe1, EU_no, countries_no, axis=1)  # EU
-    YBe2a = split_n_agg(YBe2, ROW_no, countries_no, axis=1)  # ROW
+    YBe1a = a["YBe1"]  # EU
+    YBe2a = a["YBe2"]  # ROW
 
     # Reassemble aggregated SUT
 
@@ -267,43 +354,30 @@ def aggregate(data):
     V34 = [V3a, V4a]  # bottom qudrants
     Vquad = [pd.concat(V12, axis=1), pd.concat(V34, axis=1)]
     V = pd.concat(Vquad, axis=0)  # supply
-    V.columns = V.columns.droplevel([1, 2, 3, 4])
-    V.index = V.index.droplevel([1, 2, 3, 4])
 
     U12 = [U1a, U2a]
     U34 = [U3a, U4a]
     Uquad = [pd.concat(U12, axis=1), pd.concat(U34, axis=1)]
     U = pd.concat(Uquad, axis=0)  # Use
-    U.columns = U.columns.droplevel([1, 2, 3, 4])
-    U.index = U.index.droplevel([1, 2, 3, 4])
 
     Y13 = [Y1a, Y3a]
     Y24 = [Y2a, Y4a]
     Yquad = [pd.concat(Y13, axis=0), pd.concat(Y24, axis=0)]
     Y = pd.concat(Yquad, axis=1)  # supply
-    Y.columns = Y.columns.droplevel([1, 2, 3, 4])
-    Y.index = Y.index.droplevel([1, 2, 3, 4])
 
     E = pd.concat([E1a, E2a], axis=1)  # Factor inputs
-    E.columns = E.columns.droplevel([1, 2, 3, 4])
 
     Bm = pd.concat([Bm1a, Bm2a], axis=1)  # Materials
-    Bm.columns = Bm.columns.droplevel([1, 2, 3, 4])
 
     Br = pd.concat([Br1a, Br2a], axis=1)  # Resources
-    Br.columns = Br.columns.droplevel([1, 2, 3, 4])
 
     Be = pd.concat([Be1a, Be2a], axis=1)  # Emissions
-    Be.columns = Be.columns.droplevel([1, 2, 3, 4])
 
     YBm = pd.concat([YBm1a, YBm2a], axis=1)  # Materials
-    YBm.columns = YBm.columns.droplevel([1, 2, 3, 4])
 
     YBr = pd.concat([YBr1a, YBr2a], axis=1)  # Resources
-    YBr.columns = YBr.columns.droplevel([1, 2, 3, 4])
 
     YBe = pd.concat([YBe1a, YBe2a], axis=1)  # Emissions
-    YBe.columns = YBe.columns.droplevel([1, 2, 3, 4])
 
     SUT = {"V": V,  # Supply
            "U": U,  # Use
@@ -323,18 +397,282 @@ def aggregate(data):
     return (SUT)
 
 
-def save_pkl(SUT, pickle_name):  # recommended resources/mrSUT_EU_ROW.pkl
+def relabel_regions(index, regions):
+    """
+    Replaces the region level of index according to a region mapping
+    """
+    region = pm.region_labels(index.get_level_values("country_code"),
+                              index.get_level_values("CountryGroupName"),
+                              regions)
+
+    arrays = [region if name == "region" else index.get_level_values(name)
+              for name in index.names]
+
+    return(pd.MultiIndex.from_arrays(arrays, names=index.names))
+
+
+@ins.timed("aggregate_regions")
+def aggregate_regions(data, regions=None):
+    """
+    aggregates SUTs to any number of regions in one pass, without
+    separating them by quadrants
+
+    regions is a mapping {country code: region} or a CSV file (see
+    parse_mrSUTs.read_regions), by default the region labels of the data
+    are used. Regions are ordered as they first appear in the data
+    """
+    regions = pm.read_regions(regions)
+    pm.unmapped(data["V"].index.get_level_values("country_code"), regions)
+
+    SUT = {}
+
+    for key in ["V", "U", "Y", "E", "Be", "YBe", "Br", "YBr", "Bm", "YBm"]:
+        item = data[key]
+        rows = key in ["V", "U", "Y"]  # extensions keep their rows
+
+        if regions is not None:
+            item = item.set_axis(relabel_regions(item.columns, regions),
+                                 axis=1)
+            if rows is True:
+                item = item.set_axis(relabel_regions(item.index, regions),
+                                     axis=0)
+
+        SUT[key] = agg_matrix(item, rows=rows)
+
+    for key in ["CrBe", "CrBm", "CrBr"]:  # characterisation
+        SUT[key] = data[key]
+
+    return(SUT)
+
+
+# Fused separation and aggregation
+
+def country_blocks(index, levels=country_levels):
+    """
+    Positional layout of an index made of equal country blocks with the
+    same categories in the same order: outputs the block size, the region
+    indicator matrix (regions by countries, regions in order of first
+    appearance) and the aggregated labels. None for any other layout
+    """
+    if not isinstance(index, pd.MultiIndex) or "region" not in index.names:
+        return(None)
+
+    countries, order = pd.factorize(index.get_level_values("country_code"))
+    n = len(order)
+    if n == 0 or len(index) % n != 0:
+        return(None)
+    size = len(index) // n
+
+    categories = pd.factorize(index.droplevel(levels + ["region"]))[0]
+    if not (np.array_equal(countries.reshape(n, size),
+                           np.repeat(np.arange(n), size).reshape(n, size))
+            and (categories.reshape(n, size) == categories[:size]).all()):
+        return(None)
+
+    block_regions = index.get_level_values("region")[::size]
+    codes, regions = pd.factorize(block_regions)
+    R = np.zeros((len(regions), n))
+    R[codes, np.arange(n)] = 1
+
+    # labels of the first country block of every region
+    first = [np.flatnonzero(codes == r)[0] * size + np.arange(size)
+             for r in range(len(regions))]
+    labels = index.take(np.concatenate(first)).droplevel(levels)
+
+    return(size, R, labels)
+
+
+def block_view(values, n_rows, n_cols):
+    """
+    View of a matrix as (row blocks, rows, column blocks, columns) without
+    copying it when it is contiguous
+    """
+    r, c = values.shape[0] // n_rows, values.shape[1] // n_cols
+
+    if values.flags.f_contiguous and not values.flags.c_contiguous:
+        output = values.T.reshape(n_cols, c, n_rows, r).transpose(2, 3, 0, 1)
+    else:
+        output = np.ascontiguousarray(values).reshape(n_rows, r, n_cols, c)
+
+    return(output)
+
+
+def fused_matrix(item, rows=True):
+    """
+    Separates a matrix by regions and aggregates it over the countries of
+    each region in one pass, summing country blocks of a view of the
+    matrix with region indicators. Falls back on agg_matrix for sparse
+    dataframes and for labels that are not made of equal country blocks
+    """
+    row_layout = country_blocks(item.index) if rows is True else None
+    col_layout = country_blocks(item.columns)
+
+    if (sp.is_sparse(item) or col_layout is None or
+            (rows is True and row_layout is None)):
+        return(agg_matrix(item, rows=rows))
+
+    values = item.values
+    dtype = values.dtype
+    c, S, cols = col_layout
+
+    if rows is True:
+        r, R, index = row_layout
+        X = block_view(values, R.shape[1], S.shape[1])
+        out = np.einsum("ac,cpdi,bd->apbi", R, X, S, optimize=True)
+        out = out.reshape(R.shape[0] * r, S.shape[0] * c)
+    else:
+        index = item.index
+        X = block_view(values, 1, S.shape[1])[0]
+        out = np.einsum("pdi,bd->pbi", X, S, optimize=True)
+        out = out.reshape(X.shape[0], S.shape[0] * c)
+
+    if np.issubdtype(dtype, np.floating):
+        out = out.astype(dtype, copy=False)
+
+    output = pd.DataFrame(out, index=index, columns=cols)
+
+    return(output)
+
+
+@ins.timed("aggregate_fused")
+def aggregate_fused(data):
+    """
+    Same output as aggregate(sep_b_reg(data)) computed on the whole
+    matrices, without separating them into quadrants (see fused_matrix)
+    """
+    SUT = {}
+
+    for key in ["V", "U", "Y", "E", "Be", "YBe", "Br", "YBr", "Bm", "YBm"]:
+        SUT[key] = fused_matrix(data[key], rows=key in ["V", "U", "Y"])
+
+    for key in ["CrBe", "CrBm", "CrBr"]:  # characterisation
+        SUT[key] = data[key]
+
+    return(SUT)
+
+
+# Streaming aggregation
+
+block_rows = 1000  # rows per block without a memory budget
+block_factor = 4  # peak memory of a parsed value relative to its 8 bytes
+
+
+def block_size(n_cols, max_memory=None):
+    """
+    Rows per block that keep a parsed block within max_memory bytes
+    """
+    if max_memory is None:
+        return(block_rows)
+
+    return(max(1, int(max_memory // (n_cols * 8 * block_factor))))
+
+
+@ins.timed("stream_matrix")
+def stream_matrix(key, lab, path=".", year=pm.mrSUT_year,
+                  dtype=np.float64, max_memory=None):
+    """
+    Reads, labels and aggregates a mrSUT by row blocks, only one block of
+    the text file (or archive member) is held in memory at a time. A first
+    pass reads the row labels only, then the blocks are accumulated in
+    float64 into the aggregated matrix, stored in dtype. The output equals
+    aggregate_regions of the parsed matrix
+    """
+    idx_no = pm.mrSUT_files[key][1]
+    rows = key in ["V", "U", "Y"]  # extensions keep their rows
+
+    # labels only pass: row index and row concordance of the whole matrix
+    with pm.open_mrSUT(key, path, year) as source:
+        head, source, skiprows = pm.read_head(source)  # header rows
+        n_cols = len(head.columns)
+        row = pm.read_body(source, skiprows, head, idx_no,
+                           usecols=range(idx_no))
+
+    index = pm.row_index(key, row, lab)
+    C, cols = concordance(pm.col_index(key, head.iloc[0, idx_no:], lab))
+    if rows is True:
+        R, index = concordance(index)
+        codes = R.tocsc().indices  # aggregated row of every row
+
+    output = np.zeros((len(index), len(cols)))
+    start = 0
+
+    with pm.open_mrSUT(key, path, year) as source:
+        head, source, skiprows = pm.read_head(source, head)
+        reader = pm.read_body(source, skiprows, head, idx_no, dtype,
+                              block_size(n_cols, max_memory),
+                              usecols=range(idx_no, n_cols))
+
+        for chunk in reader:
+            values = chunk.values.astype(np.float64, copy=False)
+            block = (C @ values.T).T  # aggregated columns
+            end = start + len(block)
+
+            if rows is True:  # R of the block, on the rows it touches
+                touched, local = np.unique(codes[start:end],
+                                           return_inverse=True)
+                R_block = sparse.csr_matrix(
+                    (np.ones(len(block)), (local, np.arange(len(block)))),
+                    shape=(len(touched), len(block)))
+                output[touched] += R_block @ block
+            else:
+                output[start:end] = block
+            start = end
+
+    output = pd.DataFrame(output.astype(dtype, copy=False), index=index,
+                          columns=cols)
+
+    return(output)
+
+
+def aggregate_stream(path=".", year=pm.mrSUT_year, regions=None,
+                     dtype=np.float64, max_memory=None):
+    """
+    aggregates SUTs as aggregate_regions straight from the text files,
+    without holding any whole matrix in memory (see stream_matrix)
+    """
+    lab = pm.labels(pm.classi_file, regions)
+
+    SUT = {}
+
+    for key in ["V", "U", "Y", "E", "Be", "YBe", "Br", "YBr", "Bm", "YBm"]:
+        SUT[key] = stream_matrix(key, lab, path, year, dtype, max_memory)
+
+    for key in ["CrBe", "CrBm", "CrBr"]:  # characterisation
+        SUT[key] = pm.parse_charact(key)
+
+    return(SUT)
+
+
+@ins.timed("save_pkl")
+def save_pkl(SUT, pickle_name, store=False, balance=False):
     """
     Saves SUTs, IOT balance and SUT balance
+
+    If store is True they are written as a matrix store directory instead.
+    If balance is True the supply and use balance of the SUTs is written
+    next to them as <pickle_name>_balance_<table>.csv (see balance_mrSUTs)
     """
-    w = open(pickle_name, "wb")  # pickles SUT
-    pk.dump(SUT, w, 2)  # pickling
+    if balance is True:
+        bl.to_csv(bl.check(SUT), os.path.splitext(pickle_name)[0] +
+                  "_balance")
+
+    if store is True:
+        st.save(SUT, pickle_name)
+    else:
+        w = open(pickle_name, "wb")  # pickles SUT
+        pk.dump(SUT, w, 2)  # pickling
+
+        w.close()
 
-    w.close()
 
+if __name__ == "__main__":
+    # Load serialised data
+    data = st.read("mrSUT_V3.3.pkl")  # load pickled data or matrix store
 
-# Uncomment To execute
-data_s = sep_b_reg(data)
-data_a = aggregate(data_s)
+    if separable(data):
+        data_s = sep_b_reg(data)
+        data_a = aggregate(data_s)
+    else:  # parsed with another region mapping
+        data_a = aggregate_regions(data)
 
-save = save_pkl(data_a, "mrSUT_EU_ROW_V3.3.pkl")
+    save = save_pkl(data_a, "mrSUT_EU_ROW_V3.3.pkl")
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Supply and use balance of the mrSUTs. Product supply (row
+sums of V) should equal total use (row sums of U and Y) and industry
+output (column sums of V) should equal intermediate inputs plus the
+monetary factor inputs (column sums of U and E).
+
+Only the row and column sums of the matrices are needed, so they are
+reduced while the matrices are parsed (see load_in(balance_file=...)) or
+from a dataset in memory (check) and the full matrices are never read
+again
+
+@institution:Leiden University CML
+"""
+import numpy
+import pandas as pd
+from pandas import DataFrame as df
+import sparse_mrSUTs as sp
+
+
+balance_keys = ["V", "U", "Y", "E"]
+rtol = 1e-3  # relative tolerance of an imbalance
+atol = 1e-6  # absolute tolerance of an imbalance, M.EUR
+money_unit = "M.EUR"  # factor inputs that count as inputs
+
+
+def reductions(key, matrix):
+    """
+    Outputs the row and column sums of a matrix in float64, of E only the
+    monetary factor inputs are summed over the rows
+    """
+    if sp.is_sparse(matrix):
+        values = sp.to_scipy(matrix)
+    else:
+        values = matrix.values
+
+    if key == "E" and "unit" in matrix.index.names:
+        money = numpy.asarray(matrix.index.get_level_values("unit") ==
+                              money_unit)
+        cols = values[money].sum(axis=0, dtype=numpy.float64)
+    else:
+        cols = values.sum(axis=0, dtype=numpy.float64)
+    rows = values.sum(axis=1, dtype=numpy.float64)
+
+    output = {"rows": pd.Series(numpy.asarray(rows).ravel(),
+                                index=matrix.index),
+              "cols": pd.Series(numpy.asarray(cols).ravel(),
+                                index=matrix.columns)
+              }
+
+    return(output)
+
+
+def imbalance(table, made, used, rtol=rtol, atol=atol):
+    """
+    Adds the imbalance made - used of a table, relative to the larger of
+    the two, and whether it is within tolerance
+    """
+    scale = numpy.maximum(table[made].abs(), table[used].abs())
+
+    table["imbalance"] = table[made] - table[used]
+    table["relative"] = (table["imbalance"].abs() /
+                         scale.where(scale > 0, numpy.nan)).fillna(0)
+    table["ok"] = table["imbalance"].abs() <= atol + rtol * scale
+
+    return(table)
+
+
+def by_country(table):
+    """
+    Summary of a balance table by country (or region if aggregated)
+    """
+    level = "country_code"
+    if level not in table.index.names:
+        level = "region"
+
+    groups = table.groupby(level=level, sort=False)
+    output = df({"max_abs_imbalance": groups["imbalance"].agg(
+                     lambda x: x.abs().max()),
+                 "max_relative": groups["relative"].max(),
+                 "failed": groups["ok"].agg(lambda x: int((~x).sum())),
+                 "count": groups["ok"].size()})
+
+    return(output)
+
+
+def report(sums, rtol=rtol, atol=atol):
+    """
+    Outputs the product and industry balance tables and their summary by
+    country from the reductions of V, U, Y and E
+    """
+    products = df({"supply": sums["V"]["rows"].values,
+                   "intermediate_use": sums["U"]["rows"].values,
+                   "final_demand": sums["Y"]["rows"].values},
+                  index=sums["V"]["rows"].index)
+    products["use"] = products["intermediate_use"] + products["final_demand"]
+    products = imbalance(products, "supply", "use", rtol, atol)
+
+    # E has the industries of V without their unit level, in the same order
+    industries = df({"output": sums["V"]["cols"].values,
+                     "intermediate_inputs": sums["U"]["cols"].values,
+                     "factor_inputs": sums["E"]["cols"].values},
+                    index=sums["V"]["cols"].index)
+    industries["inputs"] = (industries["intermediate_inputs"] +
+                            industries["factor_inputs"])
+    industries = imbalance(industries, "output", "inputs", rtol, atol)
+
+    output = {"products": products,
+              "industries": industries,
+              "countries": pd.concat([by_country(products),
+                                      by_country(industries)],
+                                     axis=1, keys=["products", "industries"])
+              }
+
+    return(output)
+
+
+def check(data, rtol=rtol, atol=atol):
+    """
+    Balance report of a parsed or aggregated dataset
+    """
+    sums = {key: reductions(key, data[key]) for key in balance_keys}
+
+    return(report(sums, rtol, atol))
+
+
+def to_csv(balance, prefix):
+    """
+    Writes the tables of a report as <prefix>_<table>.csv
+    """
+    for name, table in balance.items():
+        table.to_csv(prefix + "_" + name + ".csv")
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Parses the mrSUTs of several years in one run. Classifications
+and characterisation factors are the same for every year, so they are
+read and resolved once in the parent process and shared with the workers,
+which only read, convert and label the text files of their year. Each year
+is written as a matrix store (see store_mrSUTs) in out_dir/<year>
+
+The number of years parsed at the same time is bounded by processes and,
+if given, by max_memory bytes
+
+@institution:Leiden University CML
+"""
+import os
+import numpy
+from multiprocessing import Pool
+import parse_mrSUTs as pm
+import store_mrSUTs as st
+import labels_mrSUTs as lb
+
+
+memory_factor = 2  # peak memory of a parse relative to its text files
+shared = {}  # labels and characterisation factors of a worker
+
+
+def share(lab, charact):
+    """
+    Pool initializer: keeps what is shared by all years in the worker
+    """
+    shared["lab"] = lab
+    shared["charact"] = charact
+
+
+def year_memory(path, year):
+    """
+    Estimate of the peak memory needed to parse the mrSUTs of a year
+    """
+    size = sum(pm.mrSUT_size(key, path, year) for key in pm.mrSUT_files)
+
+    return(size * memory_factor)
+
+
+def workers(jobs, processes, max_memory=None):
+    """
+    Number of years to parse at the same time
+    """
+    output = min(processes, len(jobs))
+
+    if max_memory is not None:
+        peak = max(year_memory(path, year) for year, path in jobs)
+        output = min(output, int(max_memory // peak))
+
+    return(max(output, 1))
+
+
+def parse_year(year, path, out_dir, dtype=numpy.float64, sparse=False,
+               aggregate_energy=False):
+    """
+    Worker for load_years: parses the mrSUTs of a year, adds the shared
+    characterisation factors and writes them as a store
+    """
+    output = {}
+
+    for key in pm.mrSUT_files:
+        output[key] = pm.parse_mrSUT(key, shared["lab"], dtype, sparse, path,
+                                     year)
+    output.update(shared["charact"])
+
+    if aggregate_energy is True:
+        for key in ["CrBm", "Bm", "YBm"]:
+            output[key] = pm.aggregate_energy_carriers(key, output[key])
+
+    lb.intern(output)
+
+    store = os.path.join(out_dir, str(year))
+    st.save(output, store)
+
+    return([year, store])
+
+
+def load_years(years, paths=None, out_dir="mrSUT_years", processes=4,
+               max_memory=None, dtype=numpy.float64, sparse=False,
+               regions=None, aggregate_energy=False):
+    """
+    Parses the mrSUTs of years and outputs the path of the store of
+    every year
+
+    paths maps a year to the directory of its text files (or its release
+    zip archive), by default they are all in the working directory
+    """
+    if paths is None:
+        paths = {}
+    jobs = [[year, paths.get(year, ".")] for year in years]
+
+    lab = pm.labels(pm.classi_file, regions)
+    sheets = pm.charact_data()
+    charact = {key: pm.parse_charact(key, sheets[key]) for key in sheets}
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    # largest years first so that the pool is not left waiting on one
+    jobs.sort(key=lambda job: -year_memory(job[1], job[0]))
+    args = [(year, path, out_dir, dtype, sparse, aggregate_energy)
+            for year, path in jobs]
+
+    pool = Pool(processes=workers(jobs, processes, max_memory),
+                initializer=share, initargs=(lab, charact))
+    try:
+        stores = pool.starmap(parse_year, args, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    output = {year: store for year, store in sorted(stores)}
+
+    return(output)
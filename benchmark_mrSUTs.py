@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Benchmarks the stages of the pipeline on a directory of
+mrSUT text files and workbooks (e.g. written by synthetic_mrSUTs). Every
+stage runs in its own process so that its peak resident memory
+(ru_maxrss) is not hidden by the stages before it. Results are kept as
+JSON and two results can be compared to spot regressions
+
+    python benchmark_mrSUTs.py run <data_dir> [--stages ...] [--repeat 3]
+        [--processes 4] [--out results.json]
+    python benchmark_mrSUTs.py compare <old.json> <new.json>
+
+@institution:Leiden University CML
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import pandas as pd
+import parse_mrSUTs as pm
+import agg_MrSUTs as ag
+import store_mrSUTs as st
+import instrument_mrSUTs as ins
+
+
+store_dir = "benchmark_store"  # parsed data read by the later stages
+tolerance = 1.1  # slowdown or memory growth reported as a regression
+
+
+# stages: setup (not measured) and run, both take the number of processes
+
+def setup_none(processes):
+    return([processes])
+
+
+def setup_raw(processes):
+    raw = {key: pm.read_mrSUT(pm.mrSUT_path(key), idx_no)
+           for key, (file_name, idx_no) in pm.mrSUT_files.items()}
+
+    return([raw, pm.labels(pm.classi_file)])
+
+
+def setup_parsed(processes):
+    return([st.load(store_dir, mmap_mode=None)])
+
+
+def setup_separated(processes):
+    return([ag.sep_b_reg(st.load(store_dir, mmap_mode=None))])
+
+
+def run_load_mrSUT(processes):
+    pm.load_mrSUT(typed=True)
+
+
+def run_classifications(processes):
+    pm.labels(pm.classi_file)
+
+
+def run_labels(raw, lab):
+    for key in raw:
+        pm.label_mrSUT(key, raw[key], lab)
+
+
+def run_load_in(processes):
+    pm.load_in(processes=processes)
+
+
+def run_serialise(data):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pm.serialise(data, os.path.join(tmp_dir, "mrSUT.pkl"))
+
+
+stages = {"load_mrSUT": [setup_none, run_load_mrSUT],
+          "classifications": [setup_none, run_classifications],
+          "labels": [setup_raw, run_labels],
+          "load_in": [setup_none, run_load_in],
+          "serialise": [setup_parsed, run_serialise],
+          "sep_b_reg": [setup_parsed, ag.sep_b_reg],
+          "aggregate": [setup_separated, ag.aggregate],
+          }
+
+
+def measure(name, processes=4):
+    """
+    Runs a stage in this process and outputs its wall and CPU time and
+    peak resident memory in kB (also of the processes it started), with
+    the instrumented steps of the stage (see instrument_mrSUTs)
+    """
+    setup, run = stages[name]
+    args = setup(processes)
+
+    ins.enable()
+    ins.reset()
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    wall, cpu = time.perf_counter(), time.process_time()
+
+    run(*args)
+
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    output = {"wall": wall,
+              "cpu": cpu,
+              "cpu_children": children.ru_utime + children.ru_stime,
+              "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              "maxrss_setup_kb": before,
+              "maxrss_children_kb": children.ru_maxrss,
+              "steps": list(ins.records)
+              }
+
+    return(output)
+
+
+def prepare(data_dir, processes=4):
+    """
+    Parses the data once for the stages that start from parsed matrices
+    """
+    path = os.path.join(data_dir, store_dir)
+    if not os.path.exists(os.path.join(path, st.labels_file)):
+        cwd = os.getcwd()
+        os.chdir(data_dir)
+        try:
+            st.save(pm.load_in(processes=processes), store_dir)
+        finally:
+            os.chdir(cwd)
+
+
+def run(data_dir, names=None, repeat=1, processes=4, out_file=None):
+    """
+    Runs every stage repeat times, each in a new process, and outputs the
+    results. They are written to out_file as JSON if given
+    """
+    if names is None:
+        names = list(stages)
+
+    prepare(data_dir, processes)
+
+    results = {}
+    for name in names:
+        results[name] = []
+        for i in range(repeat):
+            done = subprocess.run([sys.executable, os.path.abspath(__file__),
+                                   "stage", name, "--processes",
+                                   str(processes)],
+                                  cwd=data_dir, check=True,
+                                  stdout=subprocess.PIPE)
+            last = done.stdout.decode().strip().split("\n")[-1]
+            results[name].append(json.loads(last))
+
+    sizes = {key: pm.mrSUT_size(key, data_dir) for key in pm.mrSUT_files}
+
+    output = {"meta": {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "python": platform.python_version(),
+                       "pandas": pd.__version__,
+                       "machine": platform.platform(),
+                       "processes": processes,
+                       "file_bytes": sizes},
+              "stages": results
+              }
+
+    if out_file is not None:
+        with open(out_file, "w") as w:
+            json.dump(output, w, indent=1)
+
+    return(output)
+
+
+def summary(results):
+    """
+    Table of the best wall time and the peak memory of every stage
+    """
+    C = []
+    for name, runs in results["stages"].items():
+        C.append([name, min(r["wall"] for r in runs),
+                  min(r["cpu"] + r["cpu_children"] for r in runs),
+                  max(max(r["maxrss_kb"], r["maxrss_children_kb"])
+                      for r in runs)])
+
+    output = pd.DataFrame(C, columns=["stage", "wall", "cpu", "maxrss_kb"])
+
+    return(output.set_index("stage"))
+
+
+def compare(old, new):
+    """
+    Compares two results (dicts or JSON files), ratios above tolerance are
+    flagged as regressions
+    """
+    tables = []
+    for results in [old, new]:
+        if not isinstance(results, dict):
+            with open(results) as r:
+                results = json.load(r)
+        tables.append(summary(results))
+
+    output = tables[0].join(tables[1], lsuffix="_old", rsuffix="_new",
+                            how="inner")
+    output["wall_ratio"] = output["wall_new"] / output["wall_old"]
+    output["maxrss_ratio"] = output["maxrss_kb_new"] / output["maxrss_kb_old"]
+    output["regression"] = ((output["wall_ratio"] > tolerance) |
+                            (output["maxrss_ratio"] > tolerance))
+
+    return(output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the stages of "
+                                     "the mrSUT pipeline")
+    commands = parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("data_dir")
+    run_parser.add_argument("--stages", nargs="*", choices=list(stages))
+    run_parser.add_argument("--repeat", type=int, default=1)
+    run_parser.add_argument("--processes", type=int, default=4)
+    run_parser.add_argument("--out", default=None)
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+
+    stage_parser = commands.add_parser("stage")  # used by run
+    stage_parser.add_argument("name", choices=list(stages))
+    stage_parser.add_argument("--processes", type=int, default=4)
+
+    args = parser.parse_args(argv)
+
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        if args.command == "run":
+            results = run(args.data_dir, args.stages, args.repeat,
+                          args.processes, args.out)
+            print(summary(results))
+        elif args.command == "compare":
+            print(compare(args.old, args.new))
+        elif args.command == "stage":
+            print(json.dumps(measure(args.name, args.processes)))
+        else:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Content addressed cache of parsed and labelled matrices. Each
+entry is keyed on the hash, size and modification time of its source
+files and on the parameters of the parser (including its version), so
+that only matrices whose inputs changed are parsed again. Entries are
+matrix stores (see store_mrSUTs) and are read back as memory maps
+
+Inspect or evict entries from the command line:
+    python cache_mrSUTs.py info <cache_dir>
+    python cache_mrSUTs.py evict <cache_dir> [names or entries]
+
+@institution:Leiden University CML
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import argparse
+import pandas as pd
+import store_mrSUTs as st
+
+
+hashes_file = "hashes.json"  # file hashes by path, size and mtime
+entry_file = "entry.json"  # description of an entry
+
+
+def read_hashes(hashes_path):
+    """
+    Recorded file hashes, empty if there are none or the file is
+    unreadable (the hashes are then computed again)
+    """
+    try:
+        with open(hashes_path) as r:
+            output = json.load(r)
+    except (OSError, ValueError):
+        output = {}
+
+    return(output if isinstance(output, dict) else {})
+
+
+def file_hash(path, cache_dir):
+    """
+    Outputs size, mtime and sha256 of a file, the hash is computed again
+    only if size or mtime changed since it was last recorded
+    """
+    stat = os.stat(path)
+    size, mtime = stat.st_size, stat.st_mtime_ns
+    path = os.path.abspath(path)
+
+    hashes_path = os.path.join(cache_dir, hashes_file)
+
+    known = read_hashes(hashes_path).get(path)
+    if known is not None and known[:2] == [size, mtime]:
+        return(known)
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as r:
+        for block in iter(lambda: r.read(1 << 20), b""):
+            sha.update(block)
+    output = [size, mtime, sha.hexdigest()]
+
+    # read again just before writing to keep what other runs recorded
+    hashes = read_hashes(hashes_path)
+    hashes[path] = output
+    handle, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "w") as w:
+            json.dump(hashes, w)
+        os.replace(tmp_path, hashes_path)  # atomic, readers see old or new
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    return(output)
+
+
+def entry_id(cache_dir, name, sources, params):
+    """
+    Outputs the id of the entry of a matrix and its description
+    """
+    entry = {"name": name,
+             "params": params,
+             "sources": [[os.path.basename(s)] + file_hash(s, cache_dir)
+                         for s in sources]
+             }
+
+    digest = hashlib.sha256(json.dumps(entry, sort_keys=True).encode())
+
+    # where the sources are, not part of the id so that it stays content
+    # addressed, but entries of sources elsewhere are not superseded
+    entry["paths"] = [os.path.abspath(s) for s in sources]
+
+    return(name + "-" + digest.hexdigest()[:16], entry)
+
+
+def get(cache_dir, name, sources, params):
+    """
+    Outputs the cached matrix, None if there is no entry for these inputs
+    """
+    if not os.path.isdir(cache_dir):
+        return(None)
+
+    entry, description = entry_id(cache_dir, name, sources, params)
+    path = os.path.join(cache_dir, entry)
+
+    if not os.path.exists(os.path.join(path, entry_file)):
+        return(None)
+
+    # copy on write so that the matrix can be modified like a parsed one
+    output = st.load(path, [name], mmap_mode="c")[name]
+
+    return(output)
+
+
+def superseded(cache_dir, entry, description):
+    """
+    Entries of the same matrix, source files (by absolute path) and
+    parameters as description but other versions of the sources
+    """
+    output = []
+
+    for other in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, other, entry_file)
+        if other == entry or not os.path.exists(path):
+            continue
+
+        with open(path) as r:
+            known = json.load(r)
+        if (known["name"] == description["name"] and
+                known["params"] == description["params"] and
+                known.get("paths") == description["paths"]):
+            output.append(other)
+
+    return(output)
+
+
+def put(cache_dir, name, sources, params, matrix):
+    """
+    Stores a matrix in the cache, removing the entries it supersedes
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    entry, description = entry_id(cache_dir, name, sources, params)
+    path = os.path.join(cache_dir, entry)
+
+    for other in superseded(cache_dir, entry, description):
+        shutil.rmtree(os.path.join(cache_dir, other))
+
+    st.save({name: matrix}, path)
+
+    description["created"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(os.path.join(path, entry_file), "w") as w:  # written last
+        json.dump(description, w, indent=1)
+
+
+def info(cache_dir):
+    """
+    Outputs a table of the entries in the cache
+    """
+    C = []
+
+    for entry in sorted(os.listdir(cache_dir)):
+        path = os.path.join(cache_dir, entry)
+        if not os.path.exists(os.path.join(path, entry_file)):
+            continue
+
+        with open(os.path.join(path, entry_file)) as r:
+            description = json.load(r)
+
+        size = sum(os.path.getsize(os.path.join(path, f))
+                   for f in os.listdir(path))
+
+        C.append([entry, description["name"], description["created"],
+                  size, ", ".join(s[0] for s in description["sources"]),
+                  json.dumps(description["params"], sort_keys=True)])
+
+    output = pd.DataFrame(C, columns=["entry", "name", "created", "bytes",
+                                      "sources", "params"])
+
+    return(output)
+
+
+def evict(cache_dir, names=None):
+    """
+    Removes entries by matrix name or entry id, all of them if names is
+    None, and outputs the removed entries
+    """
+    table = info(cache_dir)
+
+    if names is not None:
+        table = table[table["name"].isin(names) |
+                      table["entry"].isin(names)]
+
+    for entry in table["entry"]:
+        shutil.rmtree(os.path.join(cache_dir, entry))
+
+    return(list(table["entry"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or evict cached "
+                                     "mrSUT matrices")
+    parser.add_argument("command", choices=["info", "evict"])
+    parser.add_argument("cache_dir")
+    parser.add_argument("names", nargs="*",
+                        help="matrix names or entries to evict, all if none")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        with pd.option_context("display.width", 200,
+                               "display.max_colwidth", 60):
+            print(info(args.cache_dir).to_string(index=False))
+    else:
+        for entry in evict(args.cache_dir, args.names or None):
+            print("removed", entry)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
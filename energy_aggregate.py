@@ -77,3 +77,11 @@ names = {"Emission Relevant Energy Carrier": er_names,
          "Energy Carrier Use": ecu_names,
          "Nature Inputs": ni_names
          }
+
+# labels (name, synonym, unit) of the aggregated groups
+labels = {"Emission Relevant Energy Carrier":
+          ["Emission Relevant Energy Carrier", "EnER.tot", "TJ"],
+          "Energy Carrier Supply": ["Energy Carrier Supply", "EnS.tot", "TJ"],
+          "Energy Carrier Use": ["Energy Carrier Use", "EnU.tot", "TJ"],
+          "Nature Inputs": ["Nature Inputs", "NI.tot", "TJ"]
+          }
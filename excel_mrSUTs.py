@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Reads the sheets of the classification and characterisation
+workbooks. Every workbook is opened once, its sheets are parsed in
+parallel and, with a cache_dir, the parsed sheets are pickled under the
+hash of the workbook so that later runs do not parse any XML
+
+@institution:Leiden University CML
+"""
+import io
+import os
+import pickle as pk
+import pandas as pd
+from multiprocessing import Pool
+import cache_mrSUTs as ch
+
+
+workbook = {}  # content of the workbook parsed by a worker
+
+
+def share(content):
+    """
+    Pool initializer: keeps the content of the workbook in the worker
+    """
+    workbook["content"] = content
+
+
+def parse_sheet(sheet_name, index_col=None):
+    """
+    Worker for read_sheets: parses a sheet of the shared workbook
+    """
+    output = pd.read_excel(io.BytesIO(workbook["content"]),
+                           sheet_name=sheet_name, index_col=index_col)
+
+    return(output)
+
+
+def prefix(file_name):
+    """
+    Start of the names of the cached sheets of a workbook
+    """
+    return("sheets-" + os.path.basename(file_name) + "-")
+
+
+def cache_path(file_name, cache_dir):
+    """
+    Path of the pickle with the parsed sheets of the current version of a
+    workbook
+    """
+    sha = ch.file_hash(file_name, cache_dir)[2]
+    name = prefix(file_name) + sha[:16] + ".pkl"
+
+    return(os.path.join(cache_dir, name))
+
+
+def read_sheets(file_name, sheets, cache_dir=None, processes=1):
+    """
+    Reads the sheets of a workbook, sheets maps sheet names to their
+    index_col (see pandas.read_excel). Outputs a dict by sheet name
+
+    With processes > 1 every sheet is parsed in its own process. Each one
+    reads the shared strings and styles of the workbook again, so this only
+    pays off for workbooks with few, large sheets
+    """
+    cached = {}
+    if cache_dir is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        path = cache_path(file_name, cache_dir)
+        if os.path.exists(path):
+            with open(path, "rb") as r:
+                cached = pk.load(r)
+
+    # sheets are cached by name and index columns
+    keys = {sheet: repr([sheet, index_col])
+            for sheet, index_col in sheets.items()}
+    missing = [sheet for sheet in sheets if keys[sheet] not in cached]
+
+    if missing:
+        with open(file_name, "rb") as r:  # the only time it is opened
+            content = r.read()
+
+        jobs = [(sheet, sheets[sheet]) for sheet in missing]
+        if processes > 1 and len(jobs) > 1:
+            pool = Pool(processes=min(processes, len(jobs)),
+                        initializer=share, initargs=(content,))
+            try:
+                frames = pool.starmap(parse_sheet, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            book = pd.ExcelFile(io.BytesIO(content))
+            frames = [book.parse(sheet, index_col=index_col)
+                      for sheet, index_col in jobs]
+            book.close()
+
+        for sheet, frame in zip(missing, frames):
+            cached[keys[sheet]] = frame
+
+        if cache_dir is not None:
+            for name in os.listdir(cache_dir):  # earlier versions
+                if name.startswith(prefix(file_name)):
+                    os.remove(os.path.join(cache_dir, name))
+            with open(path, "wb") as w:
+                pk.dump(cached, w, pk.HIGHEST_PROTOCOL)
+
+    output = {sheet: cached[keys[sheet]] for sheet in sheets}
+
+    return(output)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Characterised footprints of many final demand scenarios at
+once. The characterised intensities (Cr·B per unit of product output) are
+computed once and every batch of scenarios is solved and characterised
+with matrix-matrix products
+
+@institution:Leiden University CML
+"""
+import re
+import numpy
+import pandas as pd
+from pandas import DataFrame as df
+import iot_mrSUTs as io
+
+
+# extensions and their characterisation factors
+charact_keys = {"Be": "CrBe",  # Emissions
+                "Br": "CrBr",  # Resources
+                "Bm": "CrBm",  # Materials
+                }
+
+
+def factor_columns(Cr, names):
+    """
+    Positions of the columns of Cr holding the factors of the extension
+    rows names. The sheets list them in the order of the rows, so they are
+    taken by position if their numbers match. Otherwise (e.g. a subset of
+    the rows) a name is matched to the column of the same name and
+    occurrence, with the .1, .2 suffixes pandas gives repeated columns
+    removed. Raises a KeyError for rows without a column
+    """
+    if Cr.shape[1] == len(names):
+        return(numpy.arange(len(names)))
+
+    seen = {}
+    columns = {}
+    for n, column in enumerate(Cr.columns):
+        base = re.sub(r"\.\d+$", "", str(column))
+        if base not in seen:
+            base = column  # only repeated names have a suffix
+        seen[base] = seen.get(base, 0) + 1
+        columns[(base, seen[base])] = n
+
+    output = []
+    missing = []
+    seen = {}
+    for name in names:
+        seen[name] = seen.get(name, 0) + 1
+        if (name, seen[name]) in columns:
+            output.append(columns[(name, seen[name])])
+        else:
+            missing.append(name)
+
+    if missing:
+        raise KeyError("no characterisation factors for {}".format(missing))
+
+    return(numpy.array(output))
+
+
+def characterise(Cr, B):
+    """
+    Outputs Cr·B, the factors of every row of B are found by factor_columns
+    """
+    names = B.index.get_level_values("name")
+    factors = Cr.values[:, factor_columns(Cr, names)].astype(float)
+
+    values = io.values(B)
+    output = df((values.T @ factors.T).T, index=Cr.index,
+                columns=B.columns)
+
+    return(output)
+
+
+def intensities(data, technology="industry", keys=None):
+    """
+    Outputs characterised impacts per unit of product output by extension
+    """
+    if keys is None:
+        keys = list(charact_keys)
+
+    output = {}
+
+    for key in keys:
+        CrB = characterise(data[charact_keys[key]], data[key])
+        output[key] = io.coefficients(data["V"], CrB, technology)
+
+    return(output)
+
+
+def footprints(data, Y, technology="industry", batch_size=100,
+               factors=None, impacts=None, path=None):
+    """
+    Outputs the characterised footprints of every column of Y by extension
+
+    Y has the rows of data["Y"] and one column per scenario, they are
+    solved batch_size at a time. factors (see iot_mrSUTs.build) and
+    impacts (see intensities) are computed if they are not given, with a
+    path the factors are read from or kept in it
+    """
+    if factors is None:
+        factors = io.build(data, technology, path)["factors"]
+    if impacts is None:
+        impacts = intensities(data, technology)
+
+    blocks = {key: [] for key in impacts}
+
+    for start in range(0, Y.shape[1], batch_size):
+        y = Y.iloc[:, start:start + batch_size]
+        x = io.values(io.solve(factors, y))
+
+        for key, M in impacts.items():
+            blocks[key].append(M.values @ x)
+
+    output = {}
+    for key, M in impacts.items():
+        if blocks[key]:
+            values = numpy.hstack(blocks[key])
+        else:
+            values = numpy.zeros((M.shape[0], 0))
+        output[key] = df(values, index=M.index, columns=Y.columns)
+
+    return(output)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Optional timing and memory instrumentation of the pipeline.
+Stages of parse_mrSUTs and agg_MrSUTs are wrapped in stage(...) blocks
+that record wall time, CPU time, growth of the peak resident memory and
+the shape and number of non zeros of the matrices they produce.
+
+Instrumentation is off by default and a disabled stage is a shared no-op,
+it is switched on with enable() or the environment variable
+MRSUT_INSTRUMENT=1. Stages run in pool workers are recorded when the
+workers are forked from an instrumented process. Every thread keeps its
+own open stages, thread pool workers can start from those of the thread
+that submits them (see inherit)
+
+    import instrument_mrSUTs as ins
+    ins.enable()
+    data = pm.load_in()
+    print(ins.table())
+    ins.to_json("stages.json")
+
+@institution:Leiden University CML
+"""
+import os
+import json
+import time
+import functools
+import threading
+import numpy
+import pandas as pd
+import sparse_mrSUTs as sp
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+enabled = os.environ.get("MRSUT_INSTRUMENT", "0") not in ["", "0"]
+records = []  # one dict per finished stage
+local = threading.local()  # names of the open stages of each thread
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """
+    Removes the records
+    """
+    del records[:]
+
+
+def open_stages():
+    """
+    Names of the open stages of the current thread
+    """
+    if not hasattr(local, "path"):
+        local.path = []
+
+    return(local.path)
+
+
+def inherit(names):
+    """
+    Initializer of thread pool workers, whose stages are then recorded
+    inside the stages names open in the submitting thread
+    """
+    local.path = list(names)
+
+
+def max_rss():
+    """
+    Peak resident memory of the process in kB, None if unknown
+    """
+    if resource is None:
+        return(None)
+
+    return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def matrix_info(matrix):
+    """
+    Shape and number of non zeros of a dataframe, array or sparse matrix
+    """
+    if sp.is_sparse(matrix):
+        nnz = int(sp.to_scipy(matrix).nnz)
+    elif hasattr(matrix, "nnz"):
+        nnz = int(matrix.nnz)
+    else:
+        nnz = int(numpy.count_nonzero(numpy.asarray(matrix)))
+
+    return({"shape": list(matrix.shape), "nnz": nnz})
+
+
+class Stage(object):
+    """
+    Context manager recording a stage
+    """
+
+    def __init__(self, name, key=None):
+        self.name = name
+        self.key = key
+        self.matrices = []
+
+    def __enter__(self):
+        open_stages().append(self.name)
+        self.rss = max_rss()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return(self)
+
+    def __exit__(self, kind, value, traceback):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        rss = max_rss()
+        path = open_stages()
+
+        record = {"stage": "/".join(path),
+                  "key": self.key,
+                  "wall": wall,
+                  "cpu": cpu,
+                  "maxrss_kb": rss,
+                  "maxrss_delta_kb": None if rss is None else rss - self.rss,
+                  "matrices": self.matrices,
+                  "pid": os.getpid(),
+                  "failed": kind is not None
+                  }
+        records.append(record)
+        path.pop()
+
+        return(False)
+
+    def record(self, matrix):
+        """
+        Adds the shape and non zeros of a matrix made by the stage, or of
+        every matrix of a dict
+        """
+        if isinstance(matrix, dict):
+            for item in matrix.values():
+                self.record(item)
+        elif hasattr(matrix, "shape") and len(matrix.shape) == 2:
+            self.matrices.append(matrix_info(matrix))
+
+        return(matrix)
+
+
+class Off(object):
+    """
+    Disabled stage, does nothing
+    """
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, kind, value, traceback):
+        return(False)
+
+    def record(self, matrix):
+        return(matrix)
+
+
+off = Off()
+
+
+def stage(name, key=None):
+    """
+    Outputs a context manager recording a stage, a no-op if disabled
+    """
+    if enabled is False:
+        return(off)
+
+    return(Stage(name, key))
+
+
+def timed(name):
+    """
+    Decorator recording every call of a function as a stage, with its
+    first argument as key if it is a string and the matrices it outputs
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if enabled is False:
+                return(function(*args, **kwargs))
+
+            key = args[0] if args and isinstance(args[0], str) else None
+            with Stage(name, key) as s:
+                output = function(*args, **kwargs)
+                s.record(output)
+
+            return(output)
+
+        return(wrapper)
+
+    return(decorate)
+
+
+def report():
+    """
+    Outputs the records as a table
+    """
+    C = []
+    for r in records:
+        shapes = "; ".join("x".join(str(n) for n in m["shape"])
+                           for m in r["matrices"])
+        nnz = sum(m["nnz"] for m in r["matrices"]) if r["matrices"] else None
+        C.append([r["stage"], r["key"], r["wall"], r["cpu"],
+                  r["maxrss_delta_kb"], r["maxrss_kb"], shapes, nnz,
+                  r["pid"]])
+
+    output = pd.DataFrame(C, columns=["stage", "key", "wall", "cpu",
+                                      "maxrss_delta_kb", "maxrss_kb",
+                                      "shape", "nnz", "pid"])
+
+    return(output)
+
+
+def table():
+    """
+    Outputs the report as text
+    """
+    with pd.option_context("display.width", 200, "display.max_rows", None,
+                           "display.max_columns", None):
+        output = report().to_string(index=False, float_format="%.3f")
+
+    return(output)
+
+
+def to_json(file_name=None):
+    """
+    Outputs the records as JSON, written to file_name if given
+    """
+    output = json.dumps(records, indent=1)
+
+    if file_name is not None:
+        with open(file_name, "w") as w:
+            w.write(output)
+
+    return(output)
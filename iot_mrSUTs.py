@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Builds product by product input-output tables from the
+parsed or aggregated mrSUTs (load_in, aggregate, aggregate_regions) under
+the industry or the product technology assumption.
+
+(I - A)x = y is solved with a sparse LU factorisation of I - A instead of
+an inverse. The factors can be kept next to the data so that every later
+query costs two triangular solves
+
+@institution:Leiden University CML
+"""
+import os
+import json
+import hashlib
+import numpy
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import linalg
+from pandas import DataFrame as df
+import sparse_mrSUTs as sp
+
+
+technologies = ["industry", "product"]
+factors_file = "factors.json"  # description of persisted factors
+
+
+def values(matrix):
+    """
+    Values of a sparse or dense dataframe as a csr matrix or an array
+    """
+    if sp.is_sparse(matrix):
+        output = sp.to_scipy(matrix)
+    else:
+        output = numpy.asarray(matrix.values, dtype=numpy.float64)
+
+    return(output)
+
+
+def inverse_diag(x):
+    """
+    Sparse diagonal matrix of 1/x, 0 where x is 0
+    """
+    x = numpy.asarray(x, dtype=numpy.float64).ravel()
+    inv = numpy.zeros_like(x)
+    inv[x != 0] = 1 / x[x != 0]
+
+    return(sparse.diags(inv, format="csr"))
+
+
+def outputs(V):
+    """
+    Outputs product output q and industry output g of a supply table
+    """
+    S = sparse.csr_matrix(values(V))
+
+    output = {"q": numpy.asarray(S.sum(axis=1)).ravel(),
+              "g": numpy.asarray(S.sum(axis=0)).ravel()}
+
+    return(output)
+
+
+def coefficients(V, M, technology="industry"):
+    """
+    Coefficients per unit of product output of a matrix by industry (U, E
+    or an extension) under a technology assumption
+
+    industry: M·g⁻¹·Vᵀ·q⁻¹, products are made with the technology of the
+    industries that supply them. product: M·V⁻¹, every product has its own
+    technology, which requires as many products as industries
+    """
+    if technology not in technologies:
+        raise ValueError("technology must be one of " + str(technologies))
+
+    S = sparse.csr_matrix(values(V))  # products by industries
+    X = values(M)
+
+    if technology == "industry":
+        out = outputs(V)
+        T = inverse_diag(out["g"]) @ S.T @ inverse_diag(out["q"])
+        coef = (T.T @ X.T).T
+    else:
+        if S.shape[0] != S.shape[1]:
+            raise ValueError("product technology needs a square supply "
+                             "table, it has {} products and {} industries"
+                             .format(*S.shape))
+        try:  # M·V⁻¹ from Vᵀ·coefᵀ = Mᵀ
+            lu = linalg.splu(sparse.csc_matrix(S.T))
+        except RuntimeError as error:
+            raise ValueError("singular supply table: " + str(error))
+        if sparse.issparse(X):
+            X = X.toarray()
+        coef = lu.solve(numpy.ascontiguousarray(X.T)).T
+
+    if sparse.issparse(coef):
+        coef = coef.toarray()
+
+    output = df(coef, index=M.index, columns=V.index)
+
+    return(output)
+
+
+def technical_coefficients(data, technology="industry"):
+    """
+    Outputs the product by product technical coefficients A
+    """
+    return(coefficients(data["V"], data["U"], technology))
+
+
+def digest(A):
+    """
+    Hash of the values and labels of A, identifies its factors
+    """
+    sha = hashlib.sha256(memoryview(numpy.ascontiguousarray(A.values)))
+    sha.update(repr(list(A.index)).encode())
+
+    return(sha.hexdigest())
+
+
+def factorise(A):
+    """
+    Sparse LU factorisation of I - A, Pr·(I - A)·Pc = L·U
+    """
+    n = A.shape[0]
+    M = sparse.identity(n, format="csc") - sparse.csc_matrix(A.values)
+
+    try:
+        lu = linalg.splu(M)
+    except RuntimeError as error:
+        raise ValueError("I - A is singular: " + str(error))
+
+    output = {"L": lu.L.tocsr(),
+              "U": lu.U.tocsr(),
+              "perm_r": lu.perm_r,
+              "perm_c": lu.perm_c,
+              "index": A.index,
+              "digest": digest(A),
+              "lu": lu  # in memory only, solves in one call
+              }
+
+    return(output)
+
+
+def save_factors(factors, path):
+    """
+    Writes L and U as .npz files, the permutations as .npy files and the
+    labels next to them
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    for key in ["L", "U"]:
+        sparse.save_npz(os.path.join(path, key + ".npz"), factors[key],
+                        compressed=False)
+    for key in ["perm_r", "perm_c"]:
+        numpy.save(os.path.join(path, key + ".npy"), factors[key])
+    pd.to_pickle(factors["index"], os.path.join(path, "index.pkl"))
+
+    with open(os.path.join(path, factors_file), "w") as w:  # written last
+        json.dump({"digest": factors["digest"],
+                   "n": int(factors["L"].shape[0])}, w)
+
+
+def load_factors(path):
+    """
+    Reads factors written by save_factors, None if there are none
+    """
+    if not os.path.exists(os.path.join(path, factors_file)):
+        return(None)
+
+    with open(os.path.join(path, factors_file)) as r:
+        description = json.load(r)
+
+    output = {key: sparse.load_npz(os.path.join(path, key + ".npz")).tocsr()
+              for key in ["L", "U"]}
+    for key in ["perm_r", "perm_c"]:
+        output[key] = numpy.load(os.path.join(path, key + ".npy"))
+    output["index"] = pd.read_pickle(os.path.join(path, "index.pkl"))
+    output["digest"] = description["digest"]
+
+    return(output)
+
+
+def leontief(A, path=None):
+    """
+    Outputs the factors of I - A, read from path if they were persisted
+    for the same A, otherwise computed and, with a path, persisted
+    """
+    if path is not None:
+        output = load_factors(path)
+        if output is not None and output["digest"] == digest(A):
+            return(output)
+
+    output = factorise(A)
+
+    if path is not None:
+        save_factors(output, path)
+
+    return(output)
+
+
+def solve(factors, y):
+    """
+    Solves (I - A)x = y for one or more demand vectors (columns of y)
+    """
+    labels = None
+    if isinstance(y, (df, pd.Series)):
+        labels = y
+        y = values(y)
+        if sparse.issparse(y):
+            y = y.toarray()
+    y = numpy.asarray(y, dtype=numpy.float64)
+
+    if "lu" in factors:
+        x = factors["lu"].solve(y)
+    else:
+        z = numpy.empty_like(y)
+        z[factors["perm_r"]] = y
+        w = linalg.spsolve_triangular(factors["L"], z, lower=True,
+                                      unit_diagonal=True)
+        w = linalg.spsolve_triangular(factors["U"], w, lower=False)
+        x = w[factors["perm_c"]]
+
+    if isinstance(labels, df):
+        x = df(x, index=factors["index"], columns=labels.columns)
+    elif isinstance(labels, pd.Series):
+        x = pd.Series(x, index=factors["index"], name=labels.name)
+
+    return(x)
+
+
+def build(data, technology="industry", path=None):
+    """
+    Outputs A and the factors of I - A of a dataset, with a path the
+    factors are kept in path/leontief_<technology>
+    """
+    A = technical_coefficients(data, technology)
+
+    if path is not None:
+        path = os.path.join(path, "leontief_" + technology)
+
+    output = {"A": A,
+              "factors": leontief(A, path)
+              }
+
+    return(output)
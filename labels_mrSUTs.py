@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Shared label indexes for the mrSUTs. The matrices have few
+distinct axes (products, industries, final demand and one per extension)
+that are repeated across matrices. Equal indexes are interned so that all
+the matrices on an axis reference the same MultiIndex, which holds each
+distinct label once in its levels and integer codes for the rows: pickles
+then store every axis once and stores keep them as categorical tables
+
+@institution:Leiden University CML
+"""
+import numpy
+import pandas as pd
+from pandas import DataFrame as df
+from pandas import MultiIndex as mi
+
+
+def same(a, b):
+    """
+    True if two indexes have the same labels, comparing the integer codes
+    of MultiIndexes rather than their labels
+    """
+    if a is b:
+        return(True)
+
+    if type(a) is not type(b) or len(a) != len(b) or a.names != b.names:
+        return(False)
+
+    if isinstance(a, mi):
+        for level_a, level_b, codes_a, codes_b in zip(a.levels, b.levels,
+                                                      a.codes, b.codes):
+            if not (level_a.equals(level_b) and
+                    numpy.array_equal(codes_a, codes_b)):
+                return(a.equals(b))  # same labels with other codes
+
+        return(True)
+
+    return(a.equals(b))
+
+
+class Axes(object):
+    """
+    Registry of distinct indexes, intern returns the registered index that
+    is equal to the one given
+    """
+
+    def __init__(self):
+        self.indexes = []
+
+    def intern(self, index):
+        for known in self.indexes:
+            if same(known, index):
+                return(known)
+
+        self.indexes.append(index)
+
+        return(index)
+
+    def position(self, index):
+        """
+        Position of an interned index in the registry
+        """
+        for i, known in enumerate(self.indexes):
+            if known is index:
+                return(i)
+
+        self.indexes.append(index)
+
+        return(len(self.indexes) - 1)
+
+
+def intern(data, axes=None):
+    """
+    Makes the matrices of a dataset that share an axis reference the same
+    index, in place, and outputs the registry
+    """
+    if axes is None:
+        axes = Axes()
+
+    for key, matrix in data.items():
+        matrix.index = axes.intern(matrix.index)
+        matrix.columns = axes.intern(matrix.columns)
+
+    return(axes)
+
+
+def to_table(index):
+    """
+    Outputs a MultiIndex as a table of categorical columns, other indexes
+    are kept as they are
+    """
+    if not isinstance(index, mi):
+        return(index)
+
+    columns = {}
+    for n, (level, codes) in enumerate(zip(index.levels, index.codes)):
+        columns[n] = pd.Categorical.from_codes(codes, level)
+
+    output = df(columns)
+    output.columns = list(index.names)
+
+    return(output)
+
+
+def from_table(table):
+    """
+    Outputs the MultiIndex of a table made by to_table
+    """
+    if not isinstance(table, df):
+        return(table)
+
+    # categories and codes are the levels and codes of the index
+    arrays = [table.iloc[:, n].array for n in range(table.shape[1])]
+    output = mi(levels=[a.categories for a in arrays],
+                codes=[a.codes for a in arrays],
+                names=list(table.columns), verify_integrity=False)
+
+    return(output)
+
+
+def label_positions(index, level, label):
+    """
+    Positions of the entries of index with label in level, found on the
+    integer codes. Raises a KeyError if no entry has the label, as .loc
+    """
+    if not isinstance(index, mi):
+        output = numpy.flatnonzero(index == label)
+    else:
+        n = index.names.index(level) if isinstance(level, str) else level
+        levels = index.levels[n]
+        output = numpy.array([], dtype=numpy.intp)
+        if label in levels:
+            output = numpy.flatnonzero(index.codes[n] ==
+                                       levels.get_loc(label))
+
+    if len(output) == 0:
+        raise KeyError(label)
+
+    return(output)
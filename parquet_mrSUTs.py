@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Export of parsed or aggregated mrSUTs as Parquet datasets
+that can be queried by country and sector without reading whole matrices.
+
+Every matrix is a directory of Parquet files partitioned (hive style,
+region=EU/country_code=AT) on its axis with countries: the rows of V, U
+and Y and the columns of the extensions. Labels are stored as dictionary
+encoded columns. Two layouts:
+
+    long: one row per non zero value, with the labels of both axes, those
+          of the other axis prefixed with row_ or col_
+    wide: one row per label of the country axis with its values as a
+          fixed size list, the labels of the values are in _axis.parquet
+
+read pushes region, country and sector filters down to the dataset, so
+only the partitions and row groups that match are read
+
+    import parquet_mrSUTs as pt
+    pt.save(data, "mrSUT_parquet", layout="long")
+    AT = pt.read("mrSUT_parquet", "U", countries=["AT"])
+
+Requires pyarrow
+
+@institution:Leiden University CML
+"""
+import os
+import json
+import shutil
+import numpy
+import pandas as pd
+from urllib.parse import quote
+from pandas import DataFrame as df
+import sparse_mrSUTs as sp
+import labels_mrSUTs as lb
+
+
+meta_file = "_meta.json"  # layout and label names of a matrix
+axis_file = "_axis.parquet"  # labels of the value columns of wide layout
+partition_levels = ["region", "country_code"]
+sector_level = "code"
+row_group_size = 100000  # rows of a long file read at a time
+
+
+def country_axis(matrix):
+    """
+    Axis of a matrix holding the countries, None if neither has them
+    """
+    for axis, index in [["rows", matrix.index], ["cols", matrix.columns]]:
+        if "region" in index.names:
+            return(axis)
+
+    return(None)
+
+
+def oriented(matrix, axis):
+    """
+    Values of a matrix with the country axis as rows (csr if sparse), the
+    labels of that axis and those of the other one
+    """
+    if sp.is_sparse(matrix):
+        values = sp.to_scipy(matrix).tocsr()
+    else:
+        values = matrix.values
+
+    if axis == "cols":
+        values = values.T.tocsr() if sp.is_sparse(matrix) else values.T
+        return([values, matrix.columns, matrix.index])
+
+    return([values, matrix.index, matrix.columns])
+
+
+def partitions(index):
+    """
+    Positions of the entries of index by partition {(region, country):
+    positions}, in order of first appearance
+    """
+    names = [name for name in partition_levels if name in index.names]
+    if not names:
+        return({(): numpy.arange(len(index))})
+
+    groups = lb.to_table(index).groupby(names, sort=False, observed=True)
+
+    output = {key if isinstance(key, tuple) else (key,): positions
+              for key, positions in groups.indices.items()}
+
+    return(output)
+
+
+def partition_dir(path, names, key):
+    """
+    Directory of a partition, hive style name=value
+    """
+    parts = ["{}={}".format(name, quote(str(value), safe=""))
+             for name, value in zip(names, key)]
+
+    return(os.path.join(path, *parts))
+
+
+def label_table(index, prefix=""):
+    """
+    Labels of an index as categorical columns, which are written as
+    dictionary encoded columns
+    """
+    output = lb.to_table(index)
+    if not isinstance(output, df):  # not a MultiIndex
+        output = df({"label": pd.Categorical(output)})
+    else:
+        output = output.copy()
+    output.columns = [prefix + str(name) for name in output.columns]
+
+    return(output)
+
+
+def long_frame(block, table, other, positions):
+    """
+    Non zero values of a block of rows in long layout, table and other are
+    the label tables of the rows and of the columns
+    """
+    if hasattr(block, "tocoo"):
+        coo = block.tocoo()
+        i, j, values = coo.row, coo.col, coo.data
+    else:
+        i, j = numpy.nonzero(block)
+        values = block[i, j]
+
+    output = pd.concat([table.iloc[positions[i]].reset_index(drop=True),
+                        other.iloc[j].reset_index(drop=True),
+                        df({"value": values})], axis=1)
+
+    return(output)
+
+
+def wide_table(block, table, positions):
+    """
+    Rows of a block in wide layout, their values as one fixed size list
+    column and position keeping their order in the matrix
+    """
+    import pyarrow as pa
+
+    if hasattr(block, "toarray"):
+        block = block.toarray()
+    block = numpy.ascontiguousarray(block)
+
+    frame = table.iloc[positions].reset_index(drop=True)
+    frame["position"] = positions
+    output = pa.Table.from_pandas(frame, preserve_index=False)
+
+    values = pa.FixedSizeListArray.from_arrays(pa.array(block.ravel()),
+                                               block.shape[1])
+    output = output.append_column("values", values)
+
+    return(output)
+
+
+def write_matrix(matrix, path, layout="long"):
+    """
+    Writes a matrix as a partitioned Parquet dataset in directory path
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+    axis = country_axis(matrix)
+    values, index, other = oriented(matrix, axis or "rows")
+    prefix = "col_" if axis in ["rows", None] else "row_"
+    names = [name for name in partition_levels if name in index.names]
+
+    table = label_table(index)
+    other_table = label_table(other, prefix)
+
+    for key, positions in partitions(index).items():
+        block = values[positions]
+        if layout == "long":
+            frame = long_frame(block, table, other_table, positions)
+            frame = frame.drop(columns=names)  # kept in the directory names
+            part_table = pa.Table.from_pandas(frame, preserve_index=False)
+        else:
+            part_table = wide_table(block, table, positions).drop(names)
+
+        part = partition_dir(path, names, key)
+        if not os.path.isdir(part):
+            os.makedirs(part)
+        pq.write_table(part_table, os.path.join(part, "part-0.parquet"),
+                       row_group_size=row_group_size)
+
+    if layout == "wide":  # labels without prefix, as to_index reads them
+        pq.write_table(pa.Table.from_pandas(label_table(other),
+                                            preserve_index=False),
+                       os.path.join(path, axis_file))
+
+    meta = {"layout": layout,
+            "axis": axis,
+            "partitions": names,
+            "index": list(table.columns),
+            "other": list(other_table.columns),
+            "names": [list(index.names), list(other.names)],
+            "dtype": str(values.dtype)
+            }
+    with open(os.path.join(path, meta_file), "w") as w:
+        json.dump(meta, w, indent=1)
+
+
+def save(data, path, layout="long", keys=None):
+    """
+    Writes the matrices of a dict as Parquet datasets, one directory per
+    matrix, in long or wide layout
+    """
+    if layout not in ["long", "wide"]:
+        raise ValueError("layout is long or wide, not {}".format(layout))
+
+    if keys is None:
+        keys = list(data)
+
+    for key in keys:
+        write_matrix(data[key], os.path.join(path, key), layout)
+
+
+def read_meta(path, key):
+    with open(os.path.join(path, key, meta_file)) as r:
+        return(json.load(r))
+
+
+def condition(meta, regions=None, countries=None, sectors=None):
+    """
+    Filter expression of a query on the labels of the country axis
+    """
+    import pyarrow.dataset as ds
+
+    output = None
+    for name, labels in [["region", regions], ["country_code", countries],
+                         [sector_level, sectors]]:
+        if labels is None:
+            continue
+        if name not in meta["index"]:
+            raise KeyError("{} has no {} labels".format(meta["axis"], name))
+
+        expression = ds.field(name).isin(list(labels))
+        output = expression if output is None else output & expression
+
+    return(output)
+
+
+def read(path, key, regions=None, countries=None, sectors=None):
+    """
+    Reads a matrix written by save, only the partitions and row groups of
+    the regions, country codes and sector codes asked for
+
+    The long layout is output as a table, the wide layout as a matrix
+    labelled as it was saved, with the selected entries of its country
+    axis
+    """
+    import pyarrow.dataset as ds
+
+    meta = read_meta(path, key)
+    partitioning = ds.HivePartitioning.discover(infer_dictionary=True)
+    dataset = ds.dataset(os.path.join(path, key), format="parquet",
+                         partitioning=partitioning)
+
+    table = dataset.to_table(filter=condition(meta, regions, countries,
+                                              sectors))
+
+    if meta["layout"] == "long":
+        frame = table.to_pandas()
+        return(frame[meta["index"] + meta["other"] + ["value"]])
+
+    frame = table.drop(["values"]).to_pandas()
+    order = numpy.argsort(frame["position"].values, kind="stable")
+    n_cols = table.schema.field("values").type.list_size
+    values = table.column("values").combine_chunks().flatten().to_numpy()
+    values = values.reshape(-1, n_cols)[order]
+
+    index = to_index(frame[meta["index"]].iloc[order], meta["names"][0])
+    other = to_index(pd.read_parquet(os.path.join(path, key, axis_file)),
+                     meta["names"][1])
+    output = df(values.astype(meta["dtype"], copy=False), index=index,
+                columns=other)
+
+    if meta["axis"] == "cols":
+        output = output.T
+
+    return(output)
+
+
+def to_index(table, names):
+    """
+    Index of the label columns of a table as read from Parquet
+    """
+    if list(table.columns) == ["label"]:  # not a MultiIndex
+        return(pd.Index(table["label"].astype(object).values,
+                        name=names[0]))
+
+    table = table.apply(lambda column: column.astype("category"))
+    output = lb.from_table(table).set_names(names)
+
+    return(output)
@@ -8,123 +8,320 @@ labels and pickles everything
 @author:Franco Donati
 @institution:Leiden University CML, TU Delft TPM
 """
+import io
+import os
+import re
+import zipfile
+import contextlib
 import numpy
+import scipy.sparse
+import tempfile
+import warnings
 import pickle as pk
 import pandas as pd
+from collections import OrderedDict
+from collections.abc import Mapping
 from multiprocessing import Pool
 from pandas import DataFrame as df
 from pandas import MultiIndex as mi
 import energy_aggregate as enag
+import store_mrSUTs as st
+import sparse_mrSUTs as sp
+import cache_mrSUTs as ch
+import labels_mrSUTs as lb
+import excel_mrSUTs as xl
+import instrument_mrSUTs as ins
+import balance_mrSUTs as bl
+
+
+# mrSUT text files by year and number of label columns preceding the values
+mrSUT_year = 2011
+mrSUT_files = {"V": ["mrSupply_3.3_{year}.txt", 3],  # Supply
+               "U": ["mrUse_3.3_{year}.txt", 3],  # Use
+               "Y": ["mrFinalDemand_3.3_{year}.txt", 3],  # Final demand
+               "E": ["mrFactorInputs_3.3_{year}.txt", 2],  # Factor inputs
+               "Be": ["mrEmissions_3.3_{year}.txt", 3],  # Emissions
+               "YBe": ["mrFDEmissions_3.3_{year}.txt", 3],  # Y emissions
+               "Br": ["mrResources_3.3_{year}.txt", 3],  # Resources
+               "YBr": ["mrFDResources_3.3_{year}.txt", 3],  # Y resources
+               "Bm": ["mrMaterials_3.3_{year}.txt", 2],  # Materials
+               "YBm": ["mrFDMaterials_3.3_{year}.txt", 2],  # Y materials
+               }
+
+# Label classifications and their sheets
+classi_file = "classifications3.0.13_3_dec_2016.xlsx"
+classi_sheets = {"reg": "countries",
+                 "subs": "substances",
+                 "fc_inp": "factorinputtypes",
+                 "fin_dem": "finaldemandtypes",
+                 "mat": "physicaltypes",
+                 "res": "extractions",
+                 "ind": "industrytypes",
+                 "prod": "producttypes",
+                 }
+
+# Version of the parsing and labelling, change it to invalidate the cache
+parser_version = "2"
+
+# Characterisation tables: sheet and label columns read as index
+charact_file = "characterisation_DESIRE_version3.3.xlsx"
+charact_sheets = {"CrBe": ["Q_emissions", None],  # Emissions
+                  "CrBr": ["Q_resources", [0, 1]],  # Resources
+                  "CrBm": ["Q_materials", [0, 1]],  # Materials
+                  "CrE": ["Q_factorinputs", [0, 1]],  # Factor inputs
+                  }
 
 
-def load_mrSUT():
+def is_archive(path):
     """
-    Load mrSUT, their extensions and characterisation factors
+    True if path is a zip archive of the release instead of a directory
+    """
+    return(os.path.isfile(path) and zipfile.is_zipfile(path))
+
 
+def mrSUT_path(key, path=".", year=mrSUT_year):
     """
-    V = pd.read_csv("mrSupply_3.3_2011.txt", sep="\t")  # Supply
-    U = pd.read_csv("mrUse_3.3_2011.txt", sep="\t")  # Use
-    Y = pd.read_csv("mrFinalDemand_3.3_2011.txt", sep="\t")  # Final demand
-    E = pd.read_csv("mrFactorInputs_3.3_2011.txt", sep="\t")  # Factor inputs
+    Outputs the path of the text file of a mrSUT in directory path, or the
+    archive itself if path is a zip archive (see open_mrSUT)
+    """
+    if is_archive(path):
+        return(path)
 
-    Be = pd.read_csv("mrEmissions_3.3_2011.txt", sep="\t")  # Emissions
-    YBe = pd.read_csv("mrFDEmissions_3.3_2011.txt", sep="\t")  # Y emissions
+    output = os.path.join(path, mrSUT_files[key][0].format(year=year))
 
-    Br = pd.read_csv("mrResources_3.3_2011.txt", sep="\t")  # Resources
-    YBr = pd.read_csv("mrFDResources_3.3_2011.txt", sep="\t")  # Y resources
+    return(output)
 
-    Bm = pd.read_csv("mrMaterials_3.3_2011.txt", sep="\t")  # Materials
-    YBm = pd.read_csv("mrFDMaterials_3.3_2011.txt", sep="\t")  # Y materials
 
-    # Characterization tables
-    charact = "characterisation_DESIRE_version3.3.xlsx"
-    CrBe = pd.read_excel(charact, sheet_name="Q_emissions")  # Emissions
-    CrBr = pd.read_excel(charact, sheet_name="Q_resources")  # Resources
-    CrBm = pd.read_excel(charact, sheet_name="Q_materials")  # Materials
-    CrE = pd.read_excel(charact, sheet_name="Q_factorinputs")  # Factor inputs
-
-    output = {"V": V,
-              "U": U,
-              "Y": Y,
-              "E": E,
-              "Be": Be,
-              "YBe": YBe,
-              "Br": Br,
-              "YBr": YBr,
-              "Bm": Bm,
-              "YBm": YBm,
-              "CrBe": CrBe,
-              "CrBr": CrBr,
-              "CrBm": CrBm,
-              "CrE": CrE,
+def archive_member(archive, key, year=mrSUT_year):
+    """
+    ZipInfo of the text file of a mrSUT, in any folder of an open archive
+    """
+    name = mrSUT_files[key][0].format(year=year)
+
+    for info in archive.infolist():
+        if os.path.basename(info.filename) == name:
+            return(info)
+
+    raise KeyError("{} is not in {}".format(name, archive.filename))
+
+
+def mrSUT_size(key, path=".", year=mrSUT_year):
+    """
+    Size in bytes of the text file of a mrSUT, uncompressed if archived
+    """
+    if is_archive(path):
+        with zipfile.ZipFile(path) as archive:
+            return(archive_member(archive, key, year).file_size)
+
+    return(os.path.getsize(mrSUT_path(key, path, year)))
+
+
+@contextlib.contextmanager
+def open_mrSUT(key, path=".", year=mrSUT_year):
+    """
+    Context manager giving the source of a mrSUT to read_mrSUT: the path
+    of its text file or, if path is a zip archive, a stream decompressing
+    its member, which is never extracted to disk. Members are compressed
+    on their own, so each process of load_in opens the archive and
+    decompresses its member in parallel with the others
+    """
+    if not is_archive(path):
+        yield(mrSUT_path(key, path, year))
+        return
+
+    with zipfile.ZipFile(path) as archive:
+        with archive.open(archive_member(archive, key, year)) as member:
+            yield(member)
+
+
+def read_head(source, head=None):
+    """
+    Reads the header rows of a mrSUT from a file name or a binary stream,
+    outputs them with the source of the rows and the lines to skip. A
+    head already read is passed on and the header rows only skipped
+    """
+    if isinstance(source, str):
+        if head is None:
+            head = pd.read_csv(source, sep="\t", nrows=1)
+        return([head, source, 2])
+
+    source = io.TextIOWrapper(source, encoding="utf-8")
+    header = source.readline() + source.readline()
+    if head is None:
+        head = pd.read_csv(io.StringIO(header), sep="\t", nrows=1)
+
+    return([head, source, 0])
+
+
+def read_body(source, skiprows, head, idx_no, dtype=numpy.float64,
+              chunksize=None, usecols=None):
+    """
+    Reads the rows of a mrSUT after read_head in one pass, labels as
+    objects and values in dtype, as a dataframe or an iterator of
+    chunksize rows. usecols selects columns by position
+    """
+    n_cols = len(head.columns)
+    if usecols is None:
+        usecols = range(n_cols)
+
+    if min(usecols, default=idx_no) >= idx_no:  # values only
+        types = dtype
+    elif max(usecols, default=0) < idx_no:  # labels only
+        types = object
+    else:
+        types = {i: (object if i < idx_no else dtype) for i in usecols}
+    output = pd.read_csv(source, sep="\t", header=None, skiprows=skiprows,
+                         names=range(n_cols), usecols=usecols, dtype=types,
+                         chunksize=chunksize)
+
+    return(output)
+
+
+@ins.timed("read")
+def read_mrSUT(file_name, idx_no, dtype=numpy.float64, sparse=False):
+    """
+    Reads a mrSUT text file splitting the labels from the values
+
+    The two header rows and the label columns are read in separate cheap
+    passes, the numeric block is parsed straight into dtype. If sparse is
+    True the block is read by row chunks into a sparse matrix, kept dense
+    only if its density justifies it (see sparse_mrSUTs). file_name can
+    also be a binary stream (see open_mrSUT), read in a single pass
+    """
+    if not isinstance(file_name, str):
+        return(read_stream(file_name, idx_no, dtype, sparse))
+
+    head = pd.read_csv(file_name, sep="\t", nrows=1)  # header rows
+
+    row = pd.read_csv(file_name, sep="\t", header=None, skiprows=2,
+                      usecols=range(idx_no), dtype=object)
+
+    usecols = range(idx_no, len(head.columns))
+
+    if sparse is True:
+        values = sp.read_csv(file_name, usecols, 2, dtype)
+        values = sp.to_frame(values, columns=head.columns[idx_no:])
+    else:
+        values = pd.read_csv(file_name, sep="\t", header=None, skiprows=2,
+                             usecols=usecols, dtype=dtype)
+        values.columns = head.columns[idx_no:]
+
+    output = {"col": head.iloc[0, idx_no:],  # column labels
+              "row": row,  # row labels
+              "values": values
               }
 
     return(output)
 
 
+def read_stream(stream, idx_no, dtype=numpy.float64, sparse=False,
+                chunksize=200):
+    """
+    Reads a mrSUT from a binary stream as read_mrSUT, labels and values
+    come from the same pass. If sparse is True the values are read
+    chunksize rows at a time into a sparse matrix
+    """
+    head, source, skiprows = read_head(stream)
+
+    if sparse is True:
+        chunks = read_body(source, skiprows, head, idx_no, dtype, chunksize)
+        rows = []
+        blocks = []
+        for chunk in chunks:
+            rows.append(chunk.iloc[:, :idx_no])
+            blocks.append(scipy.sparse.csr_matrix(
+                chunk.iloc[:, idx_no:].values))
+        row = pd.concat(rows, ignore_index=True)
+        values = sp.to_frame(scipy.sparse.vstack(blocks, format="csr"),
+                             columns=head.columns[idx_no:])
+    else:
+        table = read_body(source, skiprows, head, idx_no, dtype)
+        row = table.iloc[:, :idx_no]
+        values = table.iloc[:, idx_no:]
+        values.columns = head.columns[idx_no:]
+        del table
+
+    output = {"col": head.iloc[0, idx_no:],  # column labels
+              "row": row,  # row labels
+              "values": values
+              }
+
+    return(output)
+
+
+def load_mrSUT(typed=False, dtype=numpy.float64, path=".", year=mrSUT_year):
+    """
+    Load mrSUT, their extensions and characterisation factors
+
+    If typed is True each mrSUT is read with read_mrSUT, otherwise as a
+    whole object frame. path is a directory or the release zip archive
+    """
+    output = {}
+
+    for key, (file_name, idx_no) in mrSUT_files.items():
+        with open_mrSUT(key, path, year) as source:
+            if typed is True:
+                output[key] = read_mrSUT(source, idx_no, dtype)
+            else:
+                output[key] = pd.read_csv(source, sep="\t")
+
+    # Characterization tables
+    output.update(charact_data())
+
+    return(output)
+
+
 def get_mrSUT_values(data):
     """
     outputs only the values contained in the dataframes
     """
+    output = {}
 
-    V = data["V"].iloc[1:, 3:].apply(pd.to_numeric)  # Supply
-    U = data["U"].iloc[1:, 3:].apply(pd.to_numeric)  # Use
-    Y = data["Y"].iloc[1:, 3:].apply(pd.to_numeric)  # Final demand
-    E = data["E"].iloc[1:, 2:].apply(pd.to_numeric)  # Factor inputs
-    Be = data["Be"].iloc[1:, 3:].apply(pd.to_numeric)  # Emissions
-    YBe = data["YBe"].iloc[1:, 3:].apply(pd.to_numeric)  # Y emissions
-    Br = data["Br"].iloc[1:, 3:].apply(pd.to_numeric)  # Resources
-    YBr = data["YBr"].iloc[1:, 3:].apply(pd.to_numeric)  # Y resources
-    Bm = data["Bm"].iloc[1:, 2:].apply(pd.to_numeric)  # Materials
-    YBm = data["YBm"].iloc[1:, 2:].apply(pd.to_numeric)  # Y materials
+    for key, (file_name, idx_no) in mrSUT_files.items():
+        if isinstance(data[key], dict):  # already split by read_mrSUT
+            output[key] = data[key]["values"]
+        else:
+            output[key] = data[key].iloc[1:, idx_no:].apply(pd.to_numeric)
 
     # Characterisation factors
-    CrBe = data["CrBe"].iloc[2:, 4:].apply(pd.to_numeric)
-    CrBr = data["CrBr"].iloc[2:, :].apply(pd.to_numeric)
-    CrBm = data["CrBm"].iloc[1:, :].apply(pd.to_numeric)
-    CrE = data["CrE"].iloc[1:, 4:].apply(pd.to_numeric)
-
-    output = {"V": V,
-              "U": U,
-              "Y": Y,
-              "E": E,
-              "Be": Be,
-              "YBe": YBe,
-              "Br": Br,
-              "YBr": YBr,
-              "Bm": Bm,
-              "YBm": YBm,
-              "CrBe": CrBe,
-              "CrBr": CrBr,
-              "CrBm": CrBm,
-              "CrE": CrE,
-              }
+    output["CrBe"] = data["CrBe"].iloc[2:, 4:].apply(pd.to_numeric)
+    output["CrBr"] = data["CrBr"].iloc[2:, :].apply(pd.to_numeric)
+    output["CrBm"] = data["CrBm"].iloc[1:, :].apply(pd.to_numeric)
+    output["CrE"] = data["CrE"].iloc[1:, 4:].apply(pd.to_numeric)
 
     return(output)
 
 
-def labels(file):
+@ins.timed("classifications")
+def labels(file, regions=None, cache_dir=None, processes=1):
     """
-    Loads label classifications
+    Loads label classifications and the region mapping (see read_regions)
+
+    The workbook is opened once and its sheets are parsed by processes,
+    with a cache_dir they are parsed only once per version of the file
     """
-    reg = pd.read_excel(file, sheet_name="countries")
-    subs = pd.read_excel(file, sheet_name="substances")
-    fc_inp = pd.read_excel(file, sheet_name="factorinputtypes")
-    fin_dem = pd.read_excel(file, sheet_name="finaldemandtypes")
-    mat = pd.read_excel(file, sheet_name="physicaltypes")
-    res = pd.read_excel(file, sheet_name="extractions")
-    ind = pd.read_excel(file, sheet_name="industrytypes")
-    prod = pd.read_excel(file, sheet_name="producttypes")
+    sheets = xl.read_sheets(file, dict.fromkeys(classi_sheets.values()),
+                            cache_dir, processes)
 
-    output = {"reg": reg,
-              "subs": subs,
-              "fc_inp": fc_inp,
-              "fin_dem": fin_dem,
-              "mat": mat,
-              "res": res,
-              "ind": ind,
-              "prod": prod
-              }
+    output = {key: sheets[sheet] for key, sheet in classi_sheets.items()}
+    output["regions"] = read_regions(regions)
+    unmapped(output["reg"]["CountryCode"], output["regions"])
+
+    return(output)
+
+
+def charact_data(keys=None, cache_dir=None, processes=1):
+    """
+    Reads the sheets of the characterisation tables, as for labels
+    """
+    if keys is None:
+        keys = list(charact_sheets)
+
+    sheets = xl.read_sheets(charact_file,
+                            dict(charact_sheets[key] for key in keys),
+                            cache_dir, processes)
+
+    output = {key: sheets[charact_sheets[key][0]] for key in keys}
 
     return(output)
 
@@ -132,51 +329,120 @@ def labels(file):
 # reindexing
 
 
-def reg_labels(index, reg_classi):
+def match_labels(keys, classi, key_col, out_cols, names):
     """
-    ouputs df by region to use in indexing
+    Resolves keys against a classification table with a single hash join
+
+    Outputs one row per key so that the labels stay aligned with the
+    values, unmatched keys are left empty. Unmatched keys and duplicated
+    classification entries are reported with a warning
     """
+    dupl = classi[key_col].duplicated()
+    if dupl.any():
+        warnings.warn("%s: %d duplicated entries in the classification, "
+                      "the first one is used: %s"
+                      % (key_col, dupl.sum(),
+                         list(classi.loc[dupl, key_col].unique()[:5])))
+
+    lookup = classi.loc[~dupl].set_index(key_col)
+    keys = pd.Series(keys).reset_index(drop=True)
+
+    unmatched = ~keys.isin(lookup.index)
+    if unmatched.any():
+        warnings.warn("%s: %d labels not found in the classification: %s"
+                      % (key_col, unmatched.sum(),
+                         list(keys[unmatched].unique()[:5])))
+
+    output = lookup.reindex(keys.values)
+    output = output.reset_index(drop=False).loc[:, out_cols]
+    output.columns = names
+
+    return(output)
 
-    C = []
 
-    for itr, val in index.iterrows():
-        for name, values in reg_classi.iterrows():
-            cc = values.loc["CountryCode"]  # country code
-            cn = values.loc["CountryName"]  # country name
-            gc = values.loc["CountryGroup"]  # country group code
-            gn = values.loc["CountryGroupName"]  # country group name
-            if val.iloc[0].startswith(cc):
-                if gc == "WE":
-                    C.append(["EU", cc, cn, gn, gc])
-                else:
-                    C.append(["ROW", cc, cn, gn, gc])
+def read_regions(regions):
+    """
+    Outputs a region mapping {country code: region} from a dict or from a
+    CSV file whose first two columns are the country code and the region
+    """
+    if regions is None or isinstance(regions, dict):
+        return(regions)
 
-    output = df(C)
+    table = pd.read_csv(regions)
 
-    output.columns = ["region", "country_code", "country_name",
-                      "CountryGroup", "CountryGroupName"]
+    return(dict(zip(table.iloc[:, 0], table.iloc[:, 1])))
+
+
+def unmapped(country_code, regions):
+    """
+    Warns about the countries missing from a region mapping, once where
+    the mapping is resolved rather than for every labelled matrix, and
+    outputs them
+    """
+    if regions is None:
+        return([])
+
+    codes = pd.unique(pd.Series(country_code).dropna().astype(str))
+    output = [code for code in codes if code not in regions]
+    if output:
+        warnings.warn("%d countries not in the region mapping, tagged "
+                      "ROW: %s" % (len(output), output))
 
     return(output)
 
 
-def ind_labels(index, ind_classi):
+def region_labels(country_code, group_code, regions=None):
     """
-    Outputs all the labels according to industry categories
+    Outputs the region of each country: by default EU for the countries of
+    group WE and ROW for the others, otherwise according to the mapping.
+    Countries missing from the mapping are tagged ROW (see unmapped)
     """
+    country_code = pd.Series(country_code).reset_index(drop=True)
+
+    if regions is None:
+        output = pd.Series(numpy.where(numpy.asarray(group_code) == "WE",
+                                       "EU", "ROW"))
+    else:
+        output = country_code.map(regions)
+        output[output.isna() & country_code.notna()] = "ROW"
+
+    return(output.values)
 
-    C = []
 
-    for itr, val in index.iterrows():
-        for name, values in ind_classi.iterrows():
-            icode = values.loc["IndustryTypeCode"]  # industry code
-            iname = values.loc["IndustryTypeName"]  # industry name
-            isyno = values.loc["IndustryTypeSynonym"]  # ind synonym
-            if val.iloc[1] == iname:
-                C.append([icode, iname, isyno])
+def reg_labels(index, reg_classi, regions=None):
+    """
+    ouputs df by region to use in indexing, regions are assigned with
+    region_labels
+    """
+    codes = reg_classi["CountryCode"].astype(str)
+    codes = sorted(codes, key=len, reverse=True)  # longest prefix first
+    prefix = "^(" + "|".join(re.escape(cc) for cc in codes) + ")"
 
-    output = df(C)
+    # country code the label starts with
+    keys = index.iloc[:, 0].astype(str).str.extract(prefix, expand=False)
 
-    output.columns = ["code", "name", "synonym"]
+    output = match_labels(keys, reg_classi, "CountryCode",
+                          ["CountryCode", "CountryName", "CountryGroupName",
+                           "CountryGroup"],
+                          ["country_code", "country_name",
+                           "CountryGroup", "CountryGroupName"])
+
+    # as in previous versions "CountryGroupName" holds the group code
+    region = region_labels(output["country_code"],
+                           output["CountryGroupName"], regions)
+    output.insert(0, "region", region)
+
+    return(output)
+
+
+def ind_labels(index, ind_classi):
+    """
+    Outputs all the labels according to industry categories
+    """
+    output = match_labels(index.iloc[:, 1], ind_classi, "IndustryTypeName",
+                          ["IndustryTypeCode", "IndustryTypeName",
+                           "IndustryTypeSynonym"],
+                          ["code", "name", "synonym"])
 
     return(output)
 
@@ -185,391 +451,585 @@ def prod_labels(index, prod_classi):
     """
     Outputs all the labels according to product categories
     """
+    output = match_labels(index.iloc[:, 1], prod_classi, "ProductTypeName",
+                          ["ProductTypeCode", "ProductTypeName",
+                           "ProductTypeSynonym"],
+                          ["code", "name", "synonym"])
+
+    return(output)
+
+
+def Y_labels(index, Y_classi):
+    """
+    Outputs all the labels according to final demand categories
+    """
+    output = match_labels(index.iloc[:, 1], Y_classi, "FinalDemandTypeName",
+                          ["FinalDemandTypeCode", "FinalDemandTypeName",
+                           "FinalDemandTypeSynonym"],
+                          ["code", "name", "synonym"])
+
+    return(output)
+
+
+def Bmind_labels(index, Bm_classi):
+    """
+    Outputs all the labels according to materials categories
+    """
+    output = match_labels(index.iloc[:, 0], Bm_classi, "PhysicalTypeName",
+                          ["PhysicalTypeName", "PhysicalTypeSynonym"],
+                          ["name", "synonym"])
 
-    C = []
+    return(output)
+
+
+def Eind_labels(index, E_classi):
+    """
+    Outputs all the labels according to factor inputs categories
+    """
+    output = match_labels(index.iloc[:, 0], E_classi, "FactorInputTypeName",
+                          ["FactorInputTypeCode", "FactorInputTypeName",
+                           "FactorInputTypeSynonym"],
+                          ["code", "name", "synonym"])
 
-    for itr, val in index.iterrows():
-        for name, values in prod_classi.iterrows():
-            icode = values.loc["ProductTypeCode"]  # industry code
-            iname = values.loc["ProductTypeName"]  # industry name
-            isyno = values.loc["ProductTypeSynonym"]
-            if val.iloc[1] == iname:
-                C.append([icode, iname, isyno])
+    return(output)
 
-    output = df(C)
 
-    output.columns = ["code", "name", "synonym"]
+def Brind_labels(index, Br_classi):
+    """
+    Outputs all the labels according to resources categories
+    """
+    output = match_labels(index.iloc[:, 0], Br_classi, "ExtractionTypeName",
+                          ["ExtractionTypeName", "ExtractionTypeSynonym"],
+                          ["name", "synonym"])
 
     return(output)
 
 
-def Y_labels(index, Y_classi):
+def Beind_labels(index, Be_classi):
     """
-    Outputs all the labels according to final demand categories
+    Outputs all the labels according to emissions categories
     """
+    output = match_labels(index.iloc[:, 0], Be_classi, "SubstanceName",
+                          ["SubstanceCode", "SubstanceName",
+                           "SubstanceSynonym"],
+                          ["code", "name", "synonym"])
+
+    return(output)
 
-    C = []
 
-    for itr, val in index.iterrows():
-        for name, values in Y_classi.iterrows():
-            fcode = values.loc["FinalDemandTypeCode"]  # final demand code
-            fname = values.loc["FinalDemandTypeName"]  # name
-            fsyno = values.loc["FinalDemandTypeSynonym"]  # synonym
-            if val.iloc[1] == fname:
-                C.append([fcode, fname, fsyno])
+# label assembly
 
-    output = df(C)
+# row and column label axes of each mrSUT
+mrSUT_axes = {"V": ["products", "industries"],
+              "U": ["products", "industries"],
+              "Y": ["products", "final_cons"],
+              "E": ["fac_inp", "industries"],
+              "Be": ["emis", "industries"],
+              "YBe": ["emis", "final_cons"],
+              "Br": ["resour", "industries"],
+              "YBr": ["resour", "final_cons"],
+              "Bm": ["mater", "industries"],
+              "YBm": ["mater", "final_cons"],
+              }
+
+# extension row labels: labelling function, classification, unit column
+ext_labels = {"fac_inp": [Eind_labels, "fc_inp", 1],
+              "mater": [Bmind_labels, "mat", 1],
+              "resour": [Brind_labels, "res", 2],
+              "emis": [Beind_labels, "subs", 2],
+              }
 
-    output.columns = ["code", "name", "synonym"]
+
+def col_labels(col, lab, kind):
+    """
+    Outputs the labels of industries or final demand categories
+    """
+    col_ = col.reset_index(drop=False)  # index labels
+    # add country and reg. labels
+    col_reg = reg_labels(col_, lab["reg"], lab.get("regions"))
+
+    if kind == "industries":
+        col_lab = ind_labels(col_, lab["ind"])
+    else:
+        col_lab = Y_labels(col_, lab["fin_dem"])
+
+    output = pd.concat([col_reg, col_lab,
+                        df(["M.EUR"] * len(col_reg), columns=["unit"])],
+                       axis=1, ignore_index=False)
 
     return(output)
 
 
-def Bmind_labels(index, Bm_classi):
+def row_labels(row, lab, kind):
     """
-    Outputs all the labels according to materials categories
+    Outputs the labels of products or of the extensions' categories
     """
+    if kind == "products":
+        row_reg = reg_labels(row, lab["reg"], lab.get("regions"))
+        row_prod = prod_labels(row, lab["prod"])
+        output = pd.concat([row_reg, row_prod,
+                            df(["M.EUR"] * len(row_reg), columns=["unit"])],
+                           axis=1, ignore_index=False)
+    else:
+        function, classi, unit_col = ext_labels[kind]
+        row_ = row.fillna("")
+        row_lab = function(row_, lab[classi])
+        row_unit = df(row_.iloc[:, unit_col])
+        row_unit.columns = ["unit"]
+        output = pd.concat([row_lab, row_unit], axis=1, ignore_index=False)
 
-    C = []
+    return(output)
 
-    for itr, val in index.iterrows():
-        for name, values in Bm_classi.iterrows():
-            mname = values.loc["PhysicalTypeName"]  # materials name
-            msyno = values.loc["PhysicalTypeSynonym"]  # materials synonym
-            if val.iloc[0] == mname:
-                C.append([mname, msyno])
 
-    output = df(C)
+def row_index(key, row, lab):
+    """
+    Outputs the row index of a mrSUT from its label columns
+    """
+    rows = row_labels(row, lab, mrSUT_axes[key][0])
+
+    return(mi.from_arrays(rows.values.T, names=rows.columns))
 
-    output.columns = ["name", "synonym"]
+
+def col_index(key, col, lab):
+    """
+    Outputs the column index of a mrSUT from its header
+    """
+    row_kind, col_kind = mrSUT_axes[key]
+
+    cols = col_labels(col, lab, col_kind)
+    output = mi.from_arrays(cols.values.T, names=cols.columns)
+
+    if row_kind != "products":
+        output = output.droplevel(8)  # eliminating unit level
 
     return(output)
 
 
-def Eind_labels(index, E_classi):
+@ins.timed("label")
+def label_mrSUT(key, raw, lab):
     """
-    Outputs all the labels according to factor inputs categories
+    Assembles the indeces of a mrSUT read with read_mrSUT
     """
+    output = raw["values"]
+    output.index = row_index(key, raw["row"], lab)
+    output.columns = col_index(key, raw["col"], lab)
 
-    C = []
+    return(output)
 
-    for itr, val in index.iterrows():
-        for name, values in E_classi.iterrows():
-            ename = values.loc["FactorInputTypeName"]  # name
-            esyno = values.loc["FactorInputTypeSynonym"]  # synonym
-            ecode = values.loc["FactorInputTypeCode"]  # code
-            if val.iloc[0] == ename:
-                C.append([ecode, ename, esyno])
 
-    output = df(C)
+def parse_mrSUT(key, lab, dtype=numpy.float64, sparse=False, path=".",
+                year=mrSUT_year):
+    """
+    Reads and labels a single mrSUT
+    """
+    idx_no = mrSUT_files[key][1]
 
-    output.columns = ["code", "name", "synonym"]
+    with open_mrSUT(key, path, year) as source:
+        raw = read_mrSUT(source, idx_no, dtype, sparse)
+    output = label_mrSUT(key, raw, lab)
 
     return(output)
 
 
-def Brind_labels(index, Br_classi):
+def parse_to_file(key, lab, dtype, tmp_dir, sparse=False, path=".",
+                  year=mrSUT_year, balance=False):
     """
-    Outputs all the labels according to resources categories
+    Worker for load_in: parses a mrSUT and hands the values back through a
+    .npy (or .npz if sparse) file in tmp_dir instead of pickling them
+    through the pool pipe, together with the stages it recorded and, if
+    balance is True, its row and column sums (see balance_mrSUTs)
+    """
+    start = len(ins.records)
+    parsed = parse_mrSUT(key, lab, dtype, sparse, path, year)
+
+    sums = None
+    if balance is True and key in bl.balance_keys:
+        sums = bl.reductions(key, parsed)
+
+    if sp.is_sparse(parsed):
+        path = os.path.join(tmp_dir, key + ".npz")
+        scipy.sparse.save_npz(path, sp.to_scipy(parsed), compressed=False)
+    else:
+        path = os.path.join(tmp_dir, key + ".npy")
+        numpy.save(path, parsed.values)
+
+    return([key, parsed.index, parsed.columns, path, ins.records[start:],
+            sums])
+
+
+def load_from_file(path, index, columns):
+    """
+    Reads back the values written by parse_to_file
+    """
+    if path.endswith(".npz"):
+        output = sp.to_frame(scipy.sparse.load_npz(path), index, columns,
+                             max_dens=1)
+    else:
+        output = df(numpy.load(path), index=index, columns=columns,
+                    copy=False)
+
+    return(output)
+
+
+@ins.timed("charact")
+def parse_charact(key, data=None, cache_dir=None):
+    """
+    Reads and labels a single characterisation table, data is its sheet
+    if it was already read with charact_data
     """
+    if data is None:
+        data = charact_data([key], cache_dir)[key]
 
-    C = []
+    if key == "CrBe":  # Emissions
+        output = data.iloc[2:, 4:].apply(pd.to_numeric)
+        labl = data.iloc[2:, :4]
+        labl.columns = ["impact_method", "characterization",
+                        "reference", "unit"]
+        output.index = mi.from_arrays(labl.values.T, names=labl.columns)
 
-    for itr, val in index.iterrows():
-        for name, values in Br_classi.iterrows():
-            rname = values.loc["ExtractionTypeName"]  # name
-            rsyno = values.loc["ExtractionTypeSynonym"]  # synonym
-            if val.iloc[0] == rname:
-                C.append([rname, rsyno])
+    elif key == "CrBr":  # Resources
+        output = data.iloc[2:, :].apply(pd.to_numeric)
+        output.index.names = ["characterization", "unit"]
 
-    output = df(C)
+    elif key == "CrBm":  # Materials
+        output = data.iloc[1:, :].apply(pd.to_numeric)
+        output.index.names = ["characterization", "unit"]
 
-    output.columns = ["name", "synonym"]
+    else:  # Factor inputs
+        output = data.iloc[1:, 4:].apply(pd.to_numeric)
+        output.index.names = ["characterization", "unit"]
 
     return(output)
 
 
-def Beind_labels(index, Be_classi):
+# parse cache
+
+
+def cache_sources(key, path=".", year=mrSUT_year):
     """
-    Outputs all the labels according to emissions categories
+    Source files a matrix is parsed from
     """
+    if key in charact_sheets:
+        output = [charact_file]
+    else:
+        output = [mrSUT_path(key, path, year), classi_file]
 
-    C = []
+    return(output)
 
-    for itr, val in index.iterrows():
-        for name, values in Be_classi.iterrows():
-            scode = values.loc["SubstanceCode"]  # name
-            sname = values.loc["SubstanceName"]  # name
-            ssyno = values.loc["SubstanceSynonym"]  # synonym
-            if val.iloc[0] == sname:
-                C.append([scode, sname, ssyno])
 
-    output = df(C)
+def cache_params(key, dtype, sparse, regions):
+    """
+    Parameters a parsed matrix depends on besides its source files
+    """
+    regions = read_regions(regions)
 
-    output.columns = ["code", "name", "synonym"]
+    output = {"parser": parser_version,
+              "key": key,
+              "dtype": numpy.dtype(dtype).name,
+              "sparse": sparse,
+              "regions": sorted(regions.items()) if regions else None
+              }
 
     return(output)
 
 
 # begin
-def load_in(aggregate_energy=False):
-    """
-    Loads in all data
-    """
-    file = "classifications3.0.13_3_dec_2016.xlsx"
-
-    if __name__ == "__main__":
-        pool = Pool(processes=4)
-        data = load_mrSUT()
-        vals = get_mrSUT_values(data)
-        lab = labels(file)
-
-        # Industries' labels
-        Vcol_ = data["V"].iloc[0, 3:].reset_index(drop=False)  # index labels
-        Vcol_reg = reg_labels(Vcol_, lab["reg"])  # add country and reg. labels
-        Vcol_indu = ind_labels(Vcol_, lab["ind"])  # adding industry labels
-        industries = pd.concat([Vcol_reg, Vcol_indu,
-                                df(["M.EUR"] * len(Vcol_reg),
-                                   columns=["unit"])], axis=1,
-                               ignore_index=False)
-
-        # Products' labels
-        Vind_ = data["V"].iloc[1:, :3].reset_index(drop=True)
-        Vind_reg = reg_labels(Vind_, lab["reg"])
-        Vind_prod = prod_labels(Vind_, lab["prod"])
-        products = pd.concat([Vind_reg, Vind_prod,
-                              df(["M.EUR"] * len(Vind_reg), columns=["unit"])],
-                             axis=1, ignore_index=False)
-
-        # Final consumption' labels
-        Ycol_ = data["Y"].iloc[0, 3:].reset_index(drop=False)
-        Ycol_reg = reg_labels(Ycol_, lab["reg"])
-        Ycol_lab = Y_labels(Ycol_, lab["fin_dem"])
-        final_cons = pd.concat([Ycol_reg, Ycol_lab,
-                                df(["M.EUR"] * len(Ycol_reg),
-                                   columns=["unit"])], axis=1,
-                               ignore_index=False)
-
-        # E index names
-        Eind_ = data["E"].iloc[1:, :2].reset_index(drop=True).fillna("")
-        Eind_lab = Eind_labels(Eind_, lab["fc_inp"])
-        Eind_unit = df(Eind_.iloc[:, 1])
-        Eind_unit.columns = ["unit"]
-        fac_inp = pd.concat([Eind_lab, Eind_unit], axis=1, ignore_index=False)
-
-        # Bm index names
-        Bmind_ = data["Bm"].iloc[1:, :2].reset_index(drop=True).fillna("")
-        Bmind_lab = Bmind_labels(Bmind_, lab["mat"])
-        Bmind_unit = df(Bmind_.iloc[:, 1])
-        Bmind_unit.columns = ["unit"]
-        mater = pd.concat([Bmind_lab, Bmind_unit], axis=1, ignore_index=False)
-
-        # Br index names
-        Brind_ = data["Br"].iloc[1:, :3].reset_index(drop=True).fillna("")
-        Brind_lab = Brind_labels(Brind_, lab["res"])
-        Brind_unit = df(Brind_.iloc[:, 2])
-        Brind_unit.columns = ["unit"]
-        resour = pd.concat([Brind_lab, Brind_unit], axis=1, ignore_index=False)
-
-        # Be index names
-        Beind_ = data["Be"].iloc[1:, :3].reset_index(drop=True).fillna("")
-        Beind_lab = Beind_labels(Beind_, lab["subs"])
-        Beind_unit = df(Beind_.iloc[:, 2])
-        Beind_unit.columns = ["unit"]
-        emis = pd.concat([Beind_lab, Beind_unit], axis=1, ignore_index=False)
-
-        # Characterisation factors
-        CrBe_l = data["CrBe"].iloc[2:, :4]
-        CrBe_l.columns = ["impact_method", "characterization",
-                          "reference", "unit"]
-
-        CrBr_l = data["CrBr"].index.to_frame(False).iloc[2]
-        CrBr_l.index = ["characterization", "unit"]
-
-        CrBm_l = data["CrBm"].index.to_frame(False).iloc[1:, :]
-        CrBm_l.columns = ["characterization", "unit"]
-
-        CrE_l = data["CrE"].index.to_frame(False).iloc[1:, :2]
-        CrE_l.columns = ["characterization", "unit"]
-
-        del(data)
-
-        # Assembly
-
-        # V assemble indeces
-        V = vals["V"]
-        V.index = mi.from_arrays(products.values.T)
-        V.index.names = products.columns
-        V.columns = mi.from_arrays(industries.values.T)
-        V.columns.names = industries.columns
-
-        # U assemble indeces
-        U = vals["U"]
-        U.index = mi.from_arrays(products.values.T)
-        U.index.names = products.columns
-        U.columns = mi.from_arrays(industries.values.T)
-        U.columns.names = industries.columns
-
-        # Y assemble indeces
-        Y = vals["Y"]
-        Y.index = mi.from_arrays(products.values.T)
-        Y.index.names = products.columns
-        Y.columns = mi.from_arrays(final_cons.values.T)
-        Y.columns.names = final_cons.columns
-
-        # E assemble indeces
-        E = vals["E"]
-        E.columns = mi.from_arrays(industries.values.T)
-        E.columns.names = industries.columns
-        E.columns = E.columns.droplevel(8)
-        E.index = mi.from_arrays(fac_inp.values.T)
-        E.index.names = fac_inp.columns
-
-        # YBe assemble indeces
-        YBe = vals["YBe"]
-        YBe.columns = mi.from_arrays(final_cons.values.T)
-        YBe.columns.names = final_cons.columns
-        YBe.columns = YBe.columns.droplevel(8)  # eliminating unit level
-        YBe.index = mi.from_arrays(emis.values.T)
-        YBe.index.names = emis.columns
-
-        # YBm assemble indeces
-        YBm = vals["YBm"]
-        YBm.columns = mi.from_arrays(final_cons.values.T)
-        YBm.columns.names = final_cons.columns
-        YBm.columns = YBm.columns.droplevel(8)  # eliminating unit level
-        YBm.index = mi.from_arrays(mater.values.T)
-        YBm.index.names = mater.columns
-
-        # YBr assemble indeces
-        YBr = vals["YBr"]
-        YBr.columns = mi.from_arrays(final_cons.values.T)
-        YBr.columns.names = final_cons.columns
-        YBr.columns = YBr.columns.droplevel(8)  # eliminating unit level
-        YBr.index = mi.from_arrays(resour.values.T)
-        YBr.index.names = resour.columns
-
-        # Be assemble indeces
-        Be = vals["Be"]
-        Be.columns = mi.from_arrays(industries.values.T)
-        Be.columns.names = industries.columns
-        Be.columns = Be.columns.droplevel(8)
-        Be.index = mi.from_arrays(emis.values.T)
-        Be.index.names = emis.columns
-
-        # Br assemble indeces
-        Br = vals["Br"]
-        Br.columns = mi.from_arrays(industries.values.T)
-        Br.columns.names = industries.columns
-        Br.columns = Br.columns.droplevel(8)  # eliminating unit level
-        Br.index = mi.from_arrays(resour.values.T)
-        Br.index.names = resour.columns
-
-        # Bm assemble indeces
-        Bm = vals["Bm"]
-        Bm.columns = mi.from_arrays(industries.values.T)
-        Bm.columns.names = industries.columns
-        Bm.columns = Bm.columns.droplevel(8)  # eliminating unit level
-        Bm.index = mi.from_arrays(mater.values.T)
-        Bm.index.names = mater.columns
-
-        # Characterisation factors
-        # Emissions
-        CrBe = vals["CrBe"]
-        CrBe.index = mi.from_arrays(CrBe_l.values.T)
-        CrBe.index.names = CrBe_l.columns
-
-        # Resources
-        CrBr = vals["CrBr"]
-        CrBr.index.names = CrBr_l.index
-
-        # Materials
-        CrBm = vals["CrBm"]
-        CrBm.index = mi.from_arrays(CrBm_l.values.T)
-        CrBm.index.names = CrBm_l.columns
-
-        # Factor inputs
-        CrE = vals["CrE"]
-        CrE.index = mi.from_arrays(CrE_l.values.T)
-        CrE.index.names = CrE_l.columns
-
-        del(vals)
-
-        if aggregate_energy is True:
-
-            ni_lab = df(["Nature Inputs", "NI.tot", "TJ"])
-            erec_lab = df(["Emission Relevant Energy Carrier", "EnER.tot",
-                           "TJ"])
-            ecs_lab = df(["Energy Carrier Supply", "EnS.tot", "TJ"])
-            ecu_lab = df(["Energy Carrier Use", "EnU.tot", "TJ"])
-
-            en_agg_lab = {"Nature Inputs": ni_lab,
-                          "Emission Relevant Energy Carrier": erec_lab,
-                          "Energy Carrier Supply": ecs_lab,
-                          "Energy Carrier Use": ecu_lab
-                          }
-
-            keys = enag.names.keys()
-            for l in keys:
-                values = enag.names[l]
-                CrBm = aggregate(CrBm, values, l, True).T
-                labl = en_agg_lab[l]
-                labl.index = ["name", "synonym", "unit"]
-                Bm = aggregate(Bm, values, labl)  # it is
-                YBm = aggregate(YBm, values, labl)  # it is
+@ins.timed("load_in")
+def load_in(aggregate_energy=False, dtype=numpy.float64, processes=4,
+            sparse=False, regions=None, cache_dir=None, path=".",
+            year=mrSUT_year, balance_file=None, report_file=None):
+    """
+    Loads in all data, values are parsed straight into dtype
+
+    Each source file is read, converted and labelled in one of the
+    processes of the pool, largest files first. If sparse is True the
+    mrSUTs are kept as sparse dataframes. regions is an optional region
+    mapping (dict or CSV, see read_regions) replacing EU and ROW.
+    With a cache_dir, matrices whose sources and parameters did not change
+    since the last run are read from the cache (see cache_mrSUTs). The
+    mrSUT text files of year are read from directory path, or streamed from
+    the release zip archive path (see open_mrSUT). Matrices on the
+    same axis share one index (see labels_mrSUTs). With a balance_file
+    prefix the supply and use balance is reduced from the matrices as they
+    are parsed and written as CSV tables (see balance_mrSUTs). With a
+    report_file and a dtype other than float64 the mrSUTs are parsed in
+    float64 and cast, and the errors of the cast are written to
+    report_file as CSV (see precision_mrSUTs.reduced)
+    """
+    regions = read_regions(regions)
+    balance = balance_file is not None
+    report = (report_file is not None and
+              numpy.dtype(dtype) != numpy.float64)
+    storage = dtype
+    if report is True:  # the float64 reference of the report
+        dtype = numpy.float64
+    output = {}
+    sums = {}
+
+    if cache_dir is not None:
+        for key in list(mrSUT_files) + list(charact_sheets):
+            cached = ch.get(cache_dir, key,
+                            cache_sources(key, path, year),
+                            cache_params(key, dtype, sparse, regions))
+            if cached is not None:
+                output[key] = cached
+
+    keys = sorted([key for key in mrSUT_files if key not in output],
+                  key=lambda k: mrSUT_size(k, path, year),
+                  reverse=True)
+    charact_keys = [key for key in charact_sheets if key not in output]
+    parsed_keys = keys + charact_keys
+
+    lab = None
+    if keys:  # classifications are only needed to label new matrices
+        lab = labels(classi_file, regions, cache_dir)
+
+    if charact_keys:
+        sheets = charact_data(charact_keys, cache_dir)
+        for key in charact_keys:
+            output[key] = parse_charact(key, sheets[key])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pool = Pool(processes=min(processes, max(len(keys), 1)))
+
+        jobs = [(key, lab, dtype, tmp_dir, sparse, path, year, balance)
+                for key in keys]
+        parsed = pool.starmap_async(parse_to_file, jobs, chunksize=1)
+
+        for key, index, columns, file_name, records, sum_ in parsed.get():
+            output[key] = load_from_file(file_name, index, columns)
+            os.remove(file_name)
+            ins.records.extend(records)
+            if sum_ is not None:
+                sums[key] = sum_
 
         pool.close()
         pool.join()
 
-        output = {"V": V,
-                  "U": U,
-                  "Y": Y,
-                  "E": E,
-                  "Be": Be,
-                  "YBe": YBe,
-                  "Br": Br,
-                  "YBr": YBr,
-                  "Bm": Bm,
-                  "YBm": YBm,
-                  "CrBe": CrBe,
-                  "CrBr": CrBr,
-                  "CrBm": CrBm,
-                  "CrE": CrE,
-                  }
+    if cache_dir is not None:
+        for key in parsed_keys:
+            ch.put(cache_dir, key, cache_sources(key, path, year),
+                   cache_params(key, dtype, sparse, regions),
+                   output[key])
 
-        return(output)
+    # same order as the mrSUT_files and charact_sheets tables
+    output = {key: output[key]
+              for key in list(mrSUT_files) + list(charact_sheets)}
 
+    if balance is True:
+        for key in bl.balance_keys:
+            if key not in sums:  # read from the cache
+                sums[key] = bl.reductions(key, output[key])
+        bl.to_csv(bl.report(sums), balance_file)
 
-def aggregate(matrix, enag_group, new_label, characterisation=False):
+    if report is True:
+        import precision_mrSUTs as pr  # imports agg_MrSUTs, which imports this
+        output = pr.reduced(output, report_file=report_file,
+                            dtype=storage, keys=list(mrSUT_files))["data"]
 
+    if aggregate_energy is True:
+        for key in ["CrBm", "Bm", "YBm"]:
+            output[key] = aggregate_energy_carriers(key, output[key])
+
+    lb.intern(output)
+
+    return(output)
+
+
+def aggregate_rows(matrix, groups, group_labels, characterisation=False):
+    """
+    Collapses the rows of matrix whose name is in one of the groups
+    {group: [names]} with a single sparse product, the aggregated rows are
+    labelled with group_labels {group: label} and appended at the end in
+    the order of groups. Raises a KeyError listing the names of groups
+    that are not in the matrix
+
+    If characterisation is True the columns are collapsed instead and
+    averaged over the size of each group
+    """
     if characterisation is True:
         matrix = matrix.T
+
+    order = {group: n for n, group in enumerate(groups)}
+    mapping = {name: order[group] for group, members in groups.items()
+               for name in members}
+
+    names = matrix.index.get_level_values(0)
+    present = set(names)
+    missing = [name for name in mapping if name not in present]
+    if missing:  # as .loc did, a missing member would bias the averages
+        raise KeyError("not in the matrix: {}".format(missing))
+
+    group = numpy.array([mapping.get(name, -1) for name in names])
+    member = group >= 0
+
+    if sp.is_sparse(matrix):
+        values = sp.to_scipy(matrix)
     else:
-        pass
+        values = matrix.values
 
-    aggregate = df(numpy.sum(matrix.loc[enag_group, :], axis=0))
+    G = scipy.sparse.csr_matrix((numpy.ones(member.sum()),
+                                 (group[member], numpy.flatnonzero(member))),
+                                shape=(len(groups), len(names)))
+    summed = G @ values
 
     if characterisation is True:
-        aggregate = aggregate/len(enag_group)
-        aggregate.columns = [new_label]
+        sizes = numpy.array([len(members) for members in groups.values()])
+        summed = summed / sizes[:, None]
+        index = pd.Index(list(groups))
     else:
-        aggregate.columns = mi.from_arrays(new_label.values)
+        index = mi.from_tuples([tuple(group_labels[g]) for g in groups],
+                               names=matrix.index.names)
+
+    index = matrix.index[~member].append(index)
 
-    dropped = matrix.drop(enag_group)
+    if sp.is_sparse(matrix):
+        summed = scipy.sparse.vstack([values[~member],
+                                      scipy.sparse.csr_matrix(summed)])
+        output = sp.to_frame(summed.tocsr(), index, matrix.columns)
+    else:
+        summed = numpy.vstack([values[~member], numpy.asarray(summed)])
+        output = df(summed, index=index, columns=matrix.columns)
 
-    output = dropped.append(aggregate.T)
+    if characterisation is True:
+        output = output.T
 
     return(output)
 
 
-def serialise(data, file_name):  # "outputs/SUT.pkl reccomended
-    if __name__ == "__main__":
+@ins.timed("energy")
+def aggregate_energy_carriers(key, matrix, groups=None, group_labels=None):
+    """
+    Aggregates the energy carriers of CrBm, Bm and YBm, by default by
+    energy_aggregate groups, other matrices are returned as they are
+    """
+    if key not in ["CrBm", "Bm", "YBm"]:
+        return(matrix)
+
+    if groups is None:
+        groups = enag.names
+        group_labels = enag.labels
 
-        pool = Pool(processes=4)
+    output = aggregate_rows(matrix, groups, group_labels, key == "CrBm")
 
+    return(output)
+
+
+class LazySUT(Mapping):
+    """
+    Dataset with the same keys as load_in that reads, parses and labels a
+    matrix only when it is first accessed
+
+    Loaded matrices are kept in least recently used order, the oldest ones
+    are dropped when more than max_items matrices or more than max_bytes
+    bytes are held and parsed again if they are needed later
+    """
+
+    def __init__(self, aggregate_energy=False, dtype=numpy.float64,
+                 max_items=None, max_bytes=None, sparse=False,
+                 regions=None, cache_dir=None, path=".", year=mrSUT_year):
+        self.aggregate_energy = aggregate_energy
+        self.path = path
+        self.year = year
+        self.regions = read_regions(regions)
+        self.cache_dir = cache_dir
+        self.dtype = dtype
+        self.sparse = sparse
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+
+        self.names = list(mrSUT_files) + list(charact_sheets)
+        self.loaded = OrderedDict()  # least recently used first
+        self.lab = None  # classifications, read on first use
+        self.axes = lb.Axes()  # indexes shared by the matrices
+
+    def __getitem__(self, key):
+        if key in self.loaded:
+            self.loaded.move_to_end(key)
+            return(self.loaded[key])
+
+        if key not in self.names:
+            raise KeyError(key)
+
+        matrix = self.parse(key)
+        self.loaded[key] = matrix
+        self.evict()
+
+        return(matrix)
+
+    def __contains__(self, key):
+        return(key in self.names)
+
+    def __iter__(self):
+        return(iter(self.names))
+
+    def __len__(self):
+        return(len(self.names))
+
+    def parse(self, key):
+        """
+        Reads, converts and labels a single matrix, or reads it from the
+        cache if there is one
+        """
+        matrix = None
+
+        if self.cache_dir is not None:
+            sources = cache_sources(key, self.path, self.year)
+            params = cache_params(key, self.dtype, self.sparse, self.regions)
+            matrix = ch.get(self.cache_dir, key, sources, params)
+
+        if matrix is None:
+            if key in charact_sheets:
+                matrix = parse_charact(key, cache_dir=self.cache_dir)
+            else:
+                if self.lab is None:
+                    self.lab = labels(classi_file, self.regions,
+                                      self.cache_dir)
+                matrix = parse_mrSUT(key, self.lab, self.dtype, self.sparse,
+                                     self.path, self.year)
+
+            if self.cache_dir is not None:
+                ch.put(self.cache_dir, key, sources, params, matrix)
+
+        if self.aggregate_energy is True:
+            matrix = aggregate_energy_carriers(key, matrix)
+
+        lb.intern({key: matrix}, self.axes)
+
+        return(matrix)
+
+    def nbytes(self):
+        """
+        Bytes held by the loaded matrices
+        """
+        return(sum(int(m.memory_usage(index=True).sum())
+                   for m in self.loaded.values()))
+
+    def evict(self):
+        """
+        Drops least recently used matrices until within the limits, the
+        last one accessed is always kept
+        """
+        while len(self.loaded) > 1:
+            if self.max_items is not None and \
+                    len(self.loaded) > self.max_items:
+                self.loaded.popitem(last=False)
+            elif self.max_bytes is not None and \
+                    self.nbytes() > self.max_bytes:
+                self.loaded.popitem(last=False)
+            else:
+                break
+
+
+@ins.timed("serialise")
+def serialise(data, file_name, store=False):  # "outputs/SUT.pkl reccomended
+    """
+    Pickles all data or, if store is True, writes them as a matrix store
+    directory that can be memory mapped (see store_mrSUTs)
+    """
+    if store is True:
+        st.save(data, file_name)
+    else:
         w = open(file_name, "wb")  # pickles SUT
         pk.dump(data, w, 2)  # pickling
         w.close()
-
-        pool.close()
-        pool.join()
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Command line entry point of the whole pipeline, run as
+stages that each checkpoint their output in a work directory:
+
+    parse -> label -> energy -> serialise -> separate -> aggregate
+
+A run resumes after the last stage that completed with the same settings,
+--from and --to select the stages to run, --from needs the checkpoint of
+its input made with the same settings. Checkpoints are matrix stores
+(see store_mrSUTs), the outputs of serialise and aggregate are the usual
+pickles (or stores with --store). Workbooks are read from the working
+directory as in parse_mrSUTs
+
+    python pipeline_mrSUTs.py [--path .] [--year 2011] [--energy]
+        [--from label] [--to serialise] [--work mrSUT_checkpoints]
+        [--dtype float32 --report precision.csv]
+
+@institution:Leiden University CML
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import numpy
+import pickle as pk
+from multiprocessing import Pool
+import parse_mrSUTs as pm
+import agg_MrSUTs as ag
+import store_mrSUTs as st
+import precision_mrSUTs as pr
+
+
+stage_names = ["parse", "label", "energy", "serialise", "separate",
+               "aggregate"]
+done_file = "done.json"  # written last by every stage
+
+
+def read_raw(key, path, year, dtype, sparse, out_dir):
+    """
+    Worker of the parse stage: reads a mrSUT and writes its values as a
+    store and its raw labels as a pickle in out_dir/key
+    """
+    idx_no = pm.mrSUT_files[key][1]
+    with pm.open_mrSUT(key, path, year) as source:
+        raw = pm.read_mrSUT(source, idx_no, dtype, sparse)
+
+    key_dir = os.path.join(out_dir, key)
+    st.save({key: raw["values"]}, key_dir)
+    with open(os.path.join(key_dir, "raw_labels.pkl"), "wb") as w:
+        pk.dump([raw["row"], raw["col"]], w, 2)
+
+    return(key)
+
+
+def load_raw(key, out_dir):
+    """
+    Reads a mrSUT written by read_raw as read_mrSUT outputs it
+    """
+    key_dir = os.path.join(out_dir, key)
+    values = st.load(key_dir, [key], mmap_mode=None)[key]
+    with open(os.path.join(key_dir, "raw_labels.pkl"), "rb") as r:
+        row, col = pk.load(r)
+
+    return({"col": col, "row": row, "values": values})
+
+
+def reported(settings):
+    """
+    True if the errors of dtype against float64 are reported, the mrSUTs
+    are then parsed in float64 and cast by the label stage
+    """
+    return(settings["report"] is not None and
+           numpy.dtype(settings["dtype"]) != numpy.float64)
+
+
+def parse(settings, in_dir, out_dir):
+    """
+    Reads the text files, largest first, and the characterisation sheets
+    """
+    keys = sorted(pm.mrSUT_files, key=lambda k: pm.mrSUT_size(
+        k, settings["path"], settings["year"]), reverse=True)
+    dtype = numpy.float64 if reported(settings) else settings["dtype"]
+    jobs = [(key, settings["path"], settings["year"], numpy.dtype(dtype),
+             settings["sparse"], out_dir)
+            for key in keys]
+
+    pool = Pool(processes=min(settings["processes"], len(jobs)))
+    try:
+        pool.starmap(read_raw, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    with open(os.path.join(out_dir, "charact.pkl"), "wb") as w:
+        pk.dump(pm.charact_data(), w, 2)
+
+
+def label(settings, in_dir, out_dir):
+    """
+    Labels the mrSUTs and the characterisation tables, with --report the
+    mrSUTs are cast to dtype and the errors written to the report file
+    """
+    lab = pm.labels(pm.classi_file)
+
+    data = {key: pm.label_mrSUT(key, load_raw(key, in_dir), lab)
+            for key in pm.mrSUT_files}
+
+    with open(os.path.join(in_dir, "charact.pkl"), "rb") as r:
+        sheets = pk.load(r)
+    for key in pm.charact_sheets:
+        data[key] = pm.parse_charact(key, sheets[key])
+
+    if reported(settings):
+        data = pr.reduced(data, report_file=settings["report"],
+                          dtype=numpy.dtype(settings["dtype"]),
+                          keys=list(pm.mrSUT_files))["data"]
+
+    st.save(data, out_dir)
+
+
+def energy(settings, in_dir, out_dir):
+    """
+    Aggregates the energy carriers of CrBm, Bm and YBm
+    """
+    data = st.load(in_dir, mmap_mode=None)
+
+    for key in ["CrBm", "Bm", "YBm"]:
+        data[key] = pm.aggregate_energy_carriers(key, data[key])
+
+    st.save(data, out_dir)
+
+
+def serialise(settings, in_dir, out_dir):
+    """
+    Writes the parsed data to the output file
+    """
+    data = st.load(in_dir, mmap_mode=None)
+    pm.serialise(data, settings["output"], settings["store"])
+
+
+def separate(settings, in_dir, out_dir):
+    """
+    Separates the parsed data by EU and ROW, data with other regions is
+    kept whole for aggregate_regions. Whether it was separated is recorded
+    in the checkpoint
+    """
+    data = st.load(in_dir, mmap_mode=None)
+    separated = ag.separable(data)
+    if separated is True:
+        data = ag.sep_b_reg(data)
+
+    st.save(data, out_dir)
+
+    return({"separated": separated})
+
+
+def aggregate(settings, in_dir, out_dir):
+    """
+    Aggregates the separated data (or with aggregate_regions the data that
+    was not separated) and writes it to the aggregated file
+    """
+    data = st.load(in_dir, mmap_mode=None)
+    if checkpoint(in_dir)["separated"] is True:
+        data = ag.aggregate(data, settings["threads"])
+    else:
+        data = ag.aggregate_regions(data)
+    ag.save_pkl(data, settings["aggregated"], settings["store"])
+
+
+stages = {"parse": parse,
+          "label": label,
+          "energy": energy,
+          "serialise": serialise,
+          "separate": separate,
+          "aggregate": aggregate,
+          }
+
+# stage whose checkpoint a stage reads, serialise only writes the output
+inputs = {"parse": None,
+          "label": "parse",
+          "energy": "label",
+          "serialise": "energy",
+          "separate": "energy",
+          "aggregate": "separate",
+          }
+
+
+# settings that change the output of a stage
+stage_settings = {"parse": ["path", "year", "dtype", "sparse", "report"],
+                  "label": [],
+                  "energy": ["energy"],
+                  "serialise": ["output", "store"],
+                  "separate": [],
+                  "aggregate": ["aggregated", "store"],
+                  }
+
+
+def stage_dir(work, name):
+    return(os.path.join(work, name))
+
+
+def relevant(name, settings):
+    """
+    Settings of a stage and of the stages its input comes from
+    """
+    output = {}
+
+    while name is not None:
+        for key in stage_settings[name]:
+            output[key] = settings[key]
+        name = inputs[name]
+
+    return(output)
+
+
+def checkpoint(path):
+    """
+    Record of a completed stage written by run in its directory path,
+    None if the stage did not complete
+    """
+    path = os.path.join(path, done_file)
+    if not os.path.exists(path):
+        return(None)
+
+    with open(path) as r:
+        return(json.load(r))
+
+
+def is_done(work, name, settings):
+    """
+    True if a stage completed with the same relevant settings
+    """
+    done = checkpoint(stage_dir(work, name))
+    if done is None:
+        return(False)
+
+    return(done["settings"] == relevant(name, settings))
+
+
+def input_stage(name, settings):
+    """
+    Stage whose checkpoint a stage reads, the label checkpoint stands for
+    the energy one when energy carriers are not aggregated
+    """
+    source = inputs[name]
+    if source == "energy" and settings["energy"] is False:
+        source = "label"
+
+    return(source)
+
+
+def input_dir(work, name, settings):
+    """
+    Checkpoint read by a stage
+    """
+    source = input_stage(name, settings)
+
+    return(None if source is None else stage_dir(work, source))
+
+
+def plan(work, settings, first=None, last=None):
+    """
+    Outputs the stages to run: from first (by default after the last
+    completed stage) to last (by default aggregate)
+    """
+    names = stage_names[:stage_names.index(last) + 1 if last else None]
+
+    if first is None:
+        pending = [name for name in names
+                   if not is_done(work, name, settings)]
+        first = pending[0] if pending else None
+
+    if first not in names:
+        return([])
+
+    output = names[names.index(first):]
+
+    return(output)
+
+
+def run(settings, work="mrSUT_checkpoints", first=None, last=None):
+    """
+    Runs the stages of the pipeline and outputs the ones that ran. Raises
+    a RuntimeError if the checkpoint first reads is missing or stale
+    """
+    names = plan(work, settings, first, last)
+
+    if first is not None and names:
+        source = input_stage(first, settings)
+        if source is not None and not is_done(work, source, settings):
+            raise RuntimeError("cannot run from {}: the {} checkpoint in "
+                               "{} is missing or was made with other "
+                               "settings, run that stage first".format(
+                                   first, source, stage_dir(work, source)))
+
+    for name in names:
+        out_dir = stage_dir(work, name)
+        if os.path.isdir(out_dir):
+            shutil.rmtree(out_dir)
+        os.makedirs(out_dir)
+
+        for later in stage_names[stage_names.index(name) + 1:]:
+            done = os.path.join(stage_dir(work, later), done_file)
+            if os.path.exists(done):  # its input is about to change
+                os.remove(done)
+
+        record = None  # what a stage tells the stages reading it
+        if name == "energy" and settings["energy"] is False:
+            print("energy: skipped")
+        else:
+            start = time.time()
+            record = stages[name](settings, input_dir(work, name, settings),
+                                  out_dir)
+            print("{}: {:.1f}s".format(name, time.time() - start))
+
+        done = {"settings": relevant(name, settings),
+                "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+        done.update(record or {})
+        with open(os.path.join(out_dir, done_file), "w") as w:
+            json.dump(done, w)
+
+    return(names)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse and aggregate the "
+                                     "mrSUTs with stage checkpoints")
+    parser.add_argument("--path", default=".",
+                        help="directory of the mrSUT text files or the "
+                        "release zip archive")
+    parser.add_argument("--year", type=int, default=pm.mrSUT_year)
+    parser.add_argument("--work", default="mrSUT_checkpoints",
+                        help="directory of the checkpoints")
+    parser.add_argument("--output", default="mrSUT_V3.3.pkl")
+    parser.add_argument("--aggregated", default="mrSUT_EU_ROW_V3.3.pkl")
+    parser.add_argument("--store", action="store_true",
+                        help="write matrix stores instead of pickles")
+    parser.add_argument("--energy", action="store_true",
+                        help="aggregate energy carriers")
+    parser.add_argument("--dtype", default="float64")
+    parser.add_argument("--report", default=None,
+                        help="CSV file of the errors of dtype against "
+                        "float64")
+    parser.add_argument("--sparse", action="store_true")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=ag.threads,
+                        help="threads aggregating the blocks, by default "
+                        "one per CPU, 1 to aggregate serially")
+    parser.add_argument("--from", dest="first", choices=stage_names)
+    parser.add_argument("--to", dest="last", choices=stage_names)
+    args = parser.parse_args(argv)
+
+    settings = {"path": args.path,
+                "year": args.year,
+                "output": args.output,
+                "aggregated": args.aggregated,
+                "store": args.store,
+                "energy": args.energy,
+                "dtype": args.dtype,
+                "report": args.report,
+                "sparse": args.sparse,
+                "processes": args.processes,
+                "threads": args.threads,
+                }
+
+    try:
+        names = run(settings, args.work, args.first, args.last)
+    except RuntimeError as error:
+        return(str(error))
+
+    if not names:
+        print("nothing to run, all stages are done")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Reduced precision mode. Matrices can be stored and
+aggregated as float32, which halves memory and I/O, while the sums of the
+aggregation are still accumulated in float64 (see agg_MrSUTs.agg_matrix).
+error_report compares a float32 dataset with its float64 counterpart
+matrix by matrix
+
+@institution:Leiden University CML
+"""
+import numpy
+import pandas as pd
+from pandas import DataFrame as df
+import agg_MrSUTs as ag
+import sparse_mrSUTs as sp
+
+
+storage_dtype = numpy.float32
+block_cols = 1000  # columns compared at a time
+
+
+def cast(data, dtype=storage_dtype, keys=None):
+    """
+    Outputs a dataset with its float matrices in dtype, only those of keys
+    if given
+    """
+    output = {}
+
+    for key, matrix in data.items():
+        if keys is not None and key not in keys:
+            output[key] = matrix
+            continue
+        if sp.is_sparse(matrix):
+            matrix = matrix.astype(pd.SparseDtype(dtype, 0))
+        elif all(numpy.issubdtype(t, numpy.floating) for t in matrix.dtypes):
+            matrix = matrix.astype(dtype)
+        output[key] = matrix
+
+    return(output)
+
+
+def matrix_errors(matrix, reference):
+    """
+    Maximum absolute and relative error of a matrix, compared with a
+    reference with the same labels a block of columns at a time in float64
+    """
+    if sp.is_sparse(matrix):
+        matrix = matrix.sparse.to_dense()
+    if sp.is_sparse(reference):
+        reference = reference.sparse.to_dense()
+
+    max_abs = max_rel = max_ref = 0.0
+
+    for start in range(0, reference.shape[1], block_cols):
+        a = numpy.asarray(matrix.iloc[:, start:start + block_cols].values,
+                          dtype=numpy.float64)
+        b = numpy.asarray(reference.iloc[:, start:start + block_cols].values,
+                          dtype=numpy.float64)
+        err = numpy.abs(a - b)
+        nonzero = b != 0
+
+        if err.size:
+            max_abs = max(max_abs, float(err.max()))
+            max_ref = max(max_ref, float(numpy.abs(b).max()))
+        if nonzero.any():
+            max_rel = max(max_rel,
+                          float((err[nonzero] / numpy.abs(b[nonzero])).max()))
+
+    output = {"max_abs_error": max_abs,
+              "max_rel_error": max_rel,
+              "max_abs_value": max_ref}
+
+    return(output)
+
+
+def error_report(data, reference):
+    """
+    Outputs a table of the errors of every matrix of data against the
+    matrix with the same name in reference
+    """
+    C = []
+
+    for key, matrix in data.items():
+        if key not in reference:
+            continue
+        errors = matrix_errors(matrix, reference[key])
+        errors["matrix"] = key
+        errors["dtype"] = str(matrix.dtypes.iloc[0])
+        errors["bytes"] = int(matrix.memory_usage(index=False).sum())
+        C.append(errors)
+
+    output = df(C, columns=["matrix", "dtype", "bytes", "max_abs_error",
+                            "max_rel_error", "max_abs_value"])
+
+    return(output.set_index("matrix"))
+
+
+def reduced(data, regions=None, report_file=None, dtype=storage_dtype,
+            keys=None):
+    """
+    Outputs the dataset and its aggregation (see aggregate_regions) in
+    dtype together with the report of their errors against the float64
+    path, written to report_file as CSV if given. keys are the matrices
+    cast, by default all
+    """
+    aggregated = ag.aggregate_regions(data, regions)
+
+    data_r = cast(data, dtype, keys)
+    aggregated_r = ag.aggregate_regions(data_r, regions)
+
+    report = pd.concat([error_report(data_r, data),
+                        error_report(aggregated_r, aggregated)],
+                       keys=["parsed", "aggregated"], names=["stage"])
+
+    if report_file is not None:
+        report.to_csv(report_file)
+
+    output = {"data": data_r,
+              "aggregated": aggregated_r,
+              "report": report
+              }
+
+    return(output)
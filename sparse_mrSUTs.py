@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Helpers for the sparse representation of the mrSUTs. Sparse
+matrices are built while reading the CSV files and carried through the
+pipeline as pandas sparse dataframes so that they keep their labels
+
+@institution:Leiden University CML
+"""
+import numpy
+import pandas as pd
+from scipy import sparse
+from pandas import DataFrame as df
+from pandas._libs.sparse import IntIndex
+
+
+max_density = 0.3  # above this share of stored entries dense is used
+
+
+def is_sparse(frame):
+    """
+    True if all the columns of a dataframe are sparse
+    """
+    if not isinstance(frame, df) or len(frame.columns) == 0:
+        return(False)
+
+    return(all(isinstance(t, pd.SparseDtype) for t in frame.dtypes))
+
+
+def density(matrix):
+    """
+    Share of stored entries of a scipy sparse matrix
+    """
+    size = numpy.prod(matrix.shape, dtype=numpy.float64)
+
+    return(matrix.nnz / size if size else 0.0)
+
+
+def column_arrays(frame):
+    """
+    SparseArrays of the columns of a dataframe, boxed as series with
+    plain labels as a MultiIndex is slow to copy for each column
+    """
+    plain = frame.copy(deep=False)
+    plain.index = pd.RangeIndex(len(frame.index))
+    plain.columns = pd.RangeIndex(len(frame.columns))
+
+    return([column.array for _, column in plain.items()])
+
+
+def to_scipy(frame):
+    """
+    Outputs the values of a sparse or dense dataframe as a csr matrix
+    """
+    if not is_sparse(frame):
+        return(sparse.csr_matrix(frame.values))
+
+    arrays = column_arrays(frame)
+    if any(array.fill_value != 0 for array in arrays):
+        return(frame.sparse.to_coo().tocsr())
+
+    indices = [array.sp_index.to_int_index().indices for array in arrays]
+    indptr = numpy.cumsum([0] + [len(i) for i in indices])
+    data = [array.sp_values for array in arrays]
+    output = sparse.csc_matrix((numpy.concatenate(data),
+                                numpy.concatenate(indices), indptr),
+                               shape=frame.shape).tocsr()
+
+    return(output)
+
+
+def to_frame(matrix, index=None, columns=None, max_dens=max_density):
+    """
+    Wraps a scipy sparse matrix in a sparse dataframe, or in a dense one
+    if it is denser than max_dens
+    """
+    if density(matrix) > max_dens:
+        output = df(matrix.toarray(), index=index, columns=columns)
+    else:
+        # SparseArrays on slices of the csc arrays, from_spmatrix would
+        # leave a fill value of NaN in some versions
+        csc = matrix.tocsc()
+        csc.sort_indices()
+        dtype = pd.SparseDtype(csc.dtype, 0)
+        n, ptr = csc.shape[0], csc.indptr
+        rows = csc.indices.astype(numpy.int32)
+        arrays = [pd.arrays.SparseArray(
+                      csc.data[ptr[j]:ptr[j + 1]], dtype=dtype,
+                      sparse_index=IntIndex(n, rows[ptr[j]:ptr[j + 1]]))
+                  for j in range(csc.shape[1])]
+        output = df(dict(enumerate(arrays)), copy=False)
+        if index is not None:
+            output.index = index
+        if columns is not None:
+            output.columns = columns
+
+    return(output)
+
+
+def read_csv(file_name, usecols, skiprows, dtype, chunksize=200):
+    """
+    Reads a numeric block chunksize rows at a time (by default a country
+    block of products) and stacks it as a csr matrix, so that the whole
+    dense block is never held in memory
+    """
+    blocks = []
+
+    for chunk in pd.read_csv(file_name, sep="\t", header=None,
+                             skiprows=skiprows, usecols=usecols,
+                             dtype=dtype, chunksize=chunksize):
+        blocks.append(sparse.csr_matrix(chunk.values))
+
+    output = sparse.vstack(blocks, format="csr")
+
+    return(output)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Description: On-disk store for parsed and aggregated mrSUTs as an
+alternative to the monolithic pickle. Every matrix is kept as a raw .npy
+array next to a small label sidecar so that matrices can be opened with
+numpy.memmap: only the pages that are touched are read and the OS page
+cache is shared across processes
+
+@institution:Leiden University CML
+"""
+import os
+import numpy
+import pickle as pk
+import pandas as pd
+import scipy.sparse
+from pandas import DataFrame as df
+import sparse_mrSUTs as sp
+import labels_mrSUTs as lb
+
+
+labels_file = "labels.pkl"  # sidecar with the indeces of every matrix
+
+
+def save(data, path):
+    """
+    Writes a dict of dataframes as one .npy file per matrix plus labels,
+    sparse dataframes are written as uncompressed .npz csr matrices. The
+    labels sidecar holds every distinct axis once as a categorical table,
+    and the column dtypes of frames with more than one (e.g. the int and
+    float columns of CrBe), whose .npy holds their common type
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    axes = lb.Axes()
+    lab = {}
+    dtypes = {}
+
+    for key, matrix in data.items():
+        file_name = os.path.join(path, key)
+
+        for ext in [".npy", ".npz"]:  # previous version of the matrix
+            if os.path.exists(file_name + ext):
+                os.remove(file_name + ext)
+
+        if sp.is_sparse(matrix):
+            scipy.sparse.save_npz(file_name + ".npz", sp.to_scipy(matrix),
+                                  compressed=False)
+        else:
+            # the memory layout of the values is kept as it is on disk
+            numpy.save(file_name + ".npy", matrix.values)
+            if matrix.dtypes.nunique() > 1:
+                dtypes[key] = [str(dtype) for dtype in matrix.dtypes]
+        lab[key] = [axes.position(axes.intern(matrix.index)),
+                    axes.position(axes.intern(matrix.columns))]
+
+    tables = [lb.to_table(index) for index in axes.indexes]
+
+    w = open(os.path.join(path, labels_file), "wb")
+    pk.dump({"axes": tables, "matrices": lab, "dtypes": dtypes}, w, 2)
+    w.close()
+
+
+def load(path, keys=None, mmap_mode="r"):
+    """
+    Opens matrices of a store, by default as read only memory maps
+
+    keys selects the matrices to open, mmap_mode=None reads them in memory.
+    Sparse matrices are always read in memory
+    """
+    r = open(os.path.join(path, labels_file), "rb")
+    lab = pk.load(r)
+    r.close()
+
+    dtypes = lab.get("dtypes", {}) if "matrices" in lab else {}
+    if "matrices" in lab:  # shared axes, otherwise indeces by matrix
+        axes = [lb.from_table(table) for table in lab["axes"]]
+        lab = {key: [axes[i], axes[j]]
+               for key, (i, j) in lab["matrices"].items()}
+
+    if keys is None:
+        keys = list(lab)
+
+    output = {}
+
+    for key in keys:
+        index, columns = lab[key]
+        file_name = os.path.join(path, key)
+
+        if os.path.exists(file_name + ".npz"):
+            values = scipy.sparse.load_npz(file_name + ".npz")
+            output[key] = sp.to_frame(values, index, columns, max_dens=1)
+        else:
+            values = numpy.load(file_name + ".npy", mmap_mode=mmap_mode)
+            output[key] = df(values, index=index, columns=columns,
+                             copy=False)
+            if key in dtypes:
+                output[key] = restore_dtypes(output[key], dtypes[key])
+
+    return(output)
+
+
+def restore_dtypes(matrix, dtypes):
+    """
+    Casts the columns of a matrix back to their dtypes, by position as
+    names can repeat
+    """
+    output = df({n: matrix.iloc[:, n].astype(dtype)
+                 for n, dtype in enumerate(dtypes)})
+    output.index = matrix.index
+    output.columns = matrix.columns
+
+    return(output)
+
+
+def read(path, keys=None):
+    """
+    Reads either a store directory or a pickle
+    """
+    if os.path.isdir(path):
+        output = load(path, keys)
+    else:
+        output = pd.read_pickle(path)
+        if keys is not None:
+            output = {key: output[key] for key in keys}
+
+    return(output)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Writes synthetic mrSUT text files with the layout of the
+EXIOBASE 3.3 release (two header rows, label columns before the values)
+and labels taken from the classification workbook, so that the pipeline
+can be run and benchmarked without the licensed data. Values are random
+with a given share of non zero entries. The classification and
+characterisation workbooks are copied next to them
+
+    python synthetic_mrSUTs.py <out_dir> [--countries 49] [--industries 163]
+        [--products 200] [--ext-rows N] [--density 0.3] [--seed 0]
+
+@institution:Leiden University CML
+"""
+import os
+import sys
+import shutil
+import argparse
+import numpy
+import pandas as pd
+import parse_mrSUTs as pm
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+block_rows = 200  # rows generated and written at a time
+
+
+def write_mrSUT(file_name, head, col_names, countries, rows, rng,
+                density=0.3):
+    """
+    Writes a mrSUT text file, head holds the names of the label columns,
+    the columns are col_names for every country and rows are tuples of
+    row labels
+    """
+    n_cols = len(countries) * len(col_names)
+
+    with open(file_name, "w") as w:
+        w.write("\t".join(head + [c for c in countries
+                                  for n in col_names]) + "\n")
+        w.write("\t".join([""] * len(head) + col_names * len(countries)) +
+                "\n")
+
+        for start in range(0, len(rows), block_rows):
+            labels = rows[start:start + block_rows]
+            values = rng.random((len(labels), n_cols))
+            values[rng.random(values.shape) >= density] = 0
+
+            block = pd.concat([pd.DataFrame(labels),
+                               pd.DataFrame(values)], axis=1)
+            block.to_csv(w, sep="\t", header=False, index=False,
+                         float_format="%.6g")
+
+
+def generate(out_dir, countries=49, industries=163, products=200,
+             ext_rows=None, density=0.3, seed=0, year=pm.mrSUT_year):
+    """
+    Writes the ten mrSUT text files of year and the workbooks in out_dir,
+    with the first countries, industries and products of the
+    classifications and the first ext_rows rows of every extension (all
+    of them if None). Outputs the sizes
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    classi = pm.labels(os.path.join(here, pm.classi_file))
+    rng = numpy.random.default_rng(seed)
+
+    reg = classi["reg"].iloc[:countries]
+    ind = classi["ind"].iloc[:industries]
+    prod = classi["prod"].iloc[:products]
+    fin_dem = classi["fin_dem"]
+
+    cc = list(reg["CountryCode"])
+    ind_names = list(ind["IndustryTypeName"])
+    fd_names = list(fin_dem["FinalDemandTypeName"])
+
+    prod_rows = [(c, name, code) for c in cc
+                 for name, code in zip(prod["ProductTypeName"],
+                                       prod["ProductTypeCode"])]
+
+    def ext(classi_key, name_col, labels):
+        names = classi[classi_key][name_col].iloc[:ext_rows]
+        return([(name,) + labels for name in names])
+
+    # head, column names and rows of every mrSUT
+    layout = {"V": [["region", "sector", "code"], ind_names, prod_rows],
+              "U": [["region", "sector", "code"], ind_names, prod_rows],
+              "Y": [["region", "sector", "code"], fd_names, prod_rows],
+              "E": [["name", "unit"], ind_names,
+                    ext("fc_inp", "FactorInputTypeName", ("M.EUR",))],
+              "Be": [["name", "compartment", "unit"], ind_names,
+                     ext("subs", "SubstanceName", ("air", "kg"))],
+              "YBe": [["name", "compartment", "unit"], fd_names,
+                      ext("subs", "SubstanceName", ("air", "kg"))],
+              "Br": [["name", "compartment", "unit"], ind_names,
+                     ext("res", "ExtractionTypeName", ("nature", "km2"))],
+              "YBr": [["name", "compartment", "unit"], fd_names,
+                      ext("res", "ExtractionTypeName", ("nature", "km2"))],
+              "Bm": [["name", "unit"], ind_names,
+                     ext("mat", "PhysicalTypeName", ("TJ",))],
+              "YBm": [["name", "unit"], fd_names,
+                      ext("mat", "PhysicalTypeName", ("TJ",))],
+              }
+
+    output = {}
+
+    for key, (head, col_names, rows) in layout.items():
+        write_mrSUT(pm.mrSUT_path(key, out_dir, year), head, col_names, cc,
+                    rows, rng, density)
+        output[key] = [len(rows), len(cc) * len(col_names)]
+
+    for file_name in [pm.classi_file, pm.charact_file]:
+        shutil.copy(os.path.join(here, file_name), out_dir)
+
+    return(output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic mrSUTs")
+    parser.add_argument("out_dir")
+    parser.add_argument("--countries", type=int, default=49)
+    parser.add_argument("--industries", type=int, default=163)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--ext-rows", type=int, default=None)
+    parser.add_argument("--density", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--year", type=int, default=pm.mrSUT_year)
+    args = parser.parse_args(argv)
+
+    sizes = generate(args.out_dir, args.countries, args.industries,
+                     args.products, args.ext_rows, args.density, args.seed,
+                     args.year)
+    for key, (rows, cols) in sizes.items():
+        print(key, rows, "x", cols)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
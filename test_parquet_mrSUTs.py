@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Round trip of the wide Parquet layout over all the matrices
+of synthetic mrSUTs (see synthetic_mrSUTs)
+
+@institution:Leiden University CML
+"""
+import numpy
+import pytest
+import parse_mrSUTs as pm
+import parquet_mrSUTs as pt
+import synthetic_mrSUTs as sy
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("mrSUTs"))
+    sy.generate(path, countries=4, industries=5, products=6, ext_rows=3)
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(path)
+        output = pm.load_in(processes=1, path=path)
+
+    return(output)
+
+
+def test_wide_round_trip(data, tmp_path):
+    pt.save(data, str(tmp_path), layout="wide")
+
+    assert len(data) == 14
+    for key, matrix in data.items():
+        output = pt.read(str(tmp_path), key)
+
+        assert type(output.index) is type(matrix.index), key
+        assert type(output.columns) is type(matrix.columns), key
+        assert output.index.equals(matrix.index), key
+        assert output.columns.equals(matrix.columns), key
+        assert list(output.index.names) == list(matrix.index.names), key
+        assert list(output.columns.names) == list(matrix.columns.names), key
+        assert numpy.array_equal(output.values.astype(float),
+                                 matrix.values.astype(float)), key